@@ -1,4 +1,8 @@
-__all__ = ['countryGuesser', 'worldCountries', 'worldCities', 'usaStates', 'postCodes', 'canadaProvinces', 'brazilStates', 'blackList']
+__all__ = ['countryGuesser', 'worldCountries', 'worldCities', 'usaStates', 'postCodes', 'canadaProvinces', 'brazilStates', 'blackList',
+           'ahoCorasick', 'cityMatcher', 'indexSnapshot', 'lruCache', 'nameIndex', 'ruleStats', 'mappedIndex',
+           'dataRegistry', 'locationAnalysis', 'normalization', 'gazetteerOverlay', 'cityIndexBuilder',
+           'decisionTable', 'fuzzyIndex', 'resultCache', 'regionScope']
 from countryNameManager.countryGuesser import CountryGuesser
 from countryNameManager.worldCountries import WorldCountries
 from countryNameManager.worldCities import WorldCities
+from countryNameManager.ruleStats import RuleStats
@@ -0,0 +1,150 @@
+# This Python file uses the following encoding: utf-8
+
+"""Copyright 2014 Bogdan Vasilescu
+Eindhoven University of Technology
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+from array import array
+
+
+def asBytes(s):
+    # Normalised names are plain ASCII (unidecode), so one character is one
+    # byte; anything else becomes '?' and keeps the character offsets intact
+    if isinstance(s, unicode):
+        return s.encode('ascii', 'replace')
+    return s
+
+
+class AhoCorasick:
+    '''Multi-pattern string matcher. All patterns occurring in a text are
+    found in one pass over the text.
+
+    The trie is stored in flat arrays rather than one dict per state:
+    the outgoing edges of state s are the characters
+    labels[base[s]:base[s+1]] leading to targets[base[s]:base[s+1]].'''
+
+    def __init__(self, patterns):
+        # Pattern ids are positions in the sorted list of distinct patterns
+        self.patterns = sorted(set([p for p in patterns if len(p)]))
+
+        labels = bytearray()
+        self.base = array('l')
+        self.targets = array('l')
+        self.fail = array('l', [0])
+        self.out = array('l', [-1])
+        self.link = array('l', [0])
+
+        keys = [asBytes(p) for p in self.patterns]
+
+        # Build the trie breadth-first, one depth at a time. Since the keys
+        # are sorted, the keys sharing the prefix spelled by a state form a
+        # contiguous range [lo, hi), and so do the children of that state.
+        # States are numbered in BFS order, hence the failure links of the
+        # children only depend on states that have already been laid out.
+        level = [(0, 0, len(keys))]
+        depth = 0
+        while len(level):
+            next_level = []
+            for (state, lo, hi) in level:
+                self.base.append(len(labels))
+                i = lo
+                # A key ending here sorts before all its extensions
+                if i < hi and len(keys[i]) == depth:
+                    i += 1
+                while i < hi:
+                    ch = keys[i][depth]
+                    j = i + 1
+                    while j < hi and keys[j][depth] == ch:
+                        j += 1
+                    child = len(self.out)
+                    labels += ch
+                    self.targets.append(child)
+                    self.out.append(i if len(keys[i]) == depth + 1 else -1)
+                    if state:
+                        f = self.__goto(labels, self.fail[state], ch)
+                    else:
+                        f = 0
+                    self.fail.append(f)
+                    self.link.append(f if self.out[f] >= 0 else self.link[f])
+                    next_level.append((child, i, j))
+                    i = j
+            level = next_level
+            depth += 1
+        self.base.append(len(labels))
+        self.labels = str(labels)
+
+
+    '''Follow the transition on ch from state, falling back along failure
+    links. Only used while building: state is always shallower than the
+    states being laid out, so its edges are complete.'''
+    def __goto(self, labels, state, ch):
+        while True:
+            i = labels.find(ch, self.base[state], self.base[state + 1])
+            if i >= 0:
+                return self.targets[i]
+            if not state:
+                return 0
+            state = self.fail[state]
+
+
+    '''Return the ids of all patterns occurring in text.'''
+    def findIds(self, text):
+        labels = self.labels
+        base = self.base
+        targets = self.targets
+        fail = self.fail
+        out = self.out
+        link = self.link
+
+        found = set()
+        state = 0
+        for ch in asBytes(text):
+            while True:
+                i = labels.find(ch, base[state], base[state + 1])
+                if i >= 0:
+                    state = targets[i]
+                    break
+                if not state:
+                    break
+                state = fail[state]
+            t = state if out[state] >= 0 else link[state]
+            while t:
+                found.add(out[t])
+                t = link[t]
+        return found
+
+
+    '''Return the id of pattern, or None if it is not one of the patterns.
+    Walks the trie edges only, so this is an exact (dictionary) lookup.'''
+    def lookup(self, pattern):
+        labels = self.labels
+        base = self.base
+        state = 0
+        for ch in asBytes(pattern):
+            i = labels.find(ch, base[state], base[state + 1])
+            if i < 0:
+                return None
+            state = self.targets[i]
+        i = self.out[state]
+        return i if i >= 0 else None
+
+
+    '''Return all patterns occurring in text.'''
+    def findall(self, text):
+        return set([self.patterns[i] for i in self.findIds(text)])
+
+
+    def __len__(self):
+        return len(self.patterns)
@@ -0,0 +1,434 @@
+# This Python file uses the following encoding: utf-8
+
+"""Copyright 2014 Bogdan Vasilescu
+Eindhoven University of Technology
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+# Benchmarks for CountryGuesser:
+#  1) end-to-end throughput and latency percentiles of guess on sample.csv
+#  2) microbenchmarks of the individual rules and of loading each dataset
+#  3) an accuracy oracle: guesses must still match results.csv, and the
+#     lazy and exhaustive rule evaluation modes must agree
+#  4) resolving a pandas column (if pandas is installed) vs .apply(guess)
+#
+#   python benchmark.py [--repeat N] [--skip-loaders] [--fuzzy] [--scope benelux]
+#                       [--json report.json]
+
+import os
+import sys
+import json
+import time
+import argparse
+from contextlib import contextmanager
+from unicodeManager import UnicodeReader
+from unidecode import unidecode
+
+from usaStates import USAStates
+from brazilStates import BrazilStates
+from canadaProvinces import CanadaProvinces
+from worldCountries import WorldCountries
+from worldCities import WorldCities
+from blackList import BlackList
+from postCodes import PostCodes
+from cityMatcher import CityMatcher
+from countryGuesser import CountryGuesser
+from regionScope import RegionScope
+from locationAnalysis import LocationAnalysis
+import normalization
+import dataRegistry
+from mappedIndex import MAPPED_PATH
+import columnGuesser
+
+this_dir, this_filename = os.path.split(__file__)
+DATA_PATH = os.path.join(this_dir, 'data')
+
+
+class NullWriter:
+    def write(self, s):
+        pass
+
+
+@contextmanager
+def quiet():
+    # Keep the guesser's reporting on stdout out of the measurements
+    stdout = sys.stdout
+    sys.stdout = NullWriter()
+    try:
+        yield
+    finally:
+        sys.stdout = stdout
+
+
+def percentile(sortedValues, p):
+    if not len(sortedValues):
+        return None
+    k = int(round(p / 100.0 * (len(sortedValues) - 1)))
+    return sortedValues[k]
+
+
+def summary(latencies, total):
+    latencies = sorted(latencies)
+    # Without calls (e.g., an empty corpus) there are no percentiles
+    micros = lambda seconds: seconds * 1e6 if seconds is not None else None
+    return {
+        'calls':len(latencies),
+        'seconds':total,
+        'per_second':len(latencies) / total if total else None,
+        'p50_us':micros(percentile(latencies, 50)),
+        'p90_us':micros(percentile(latencies, 90)),
+        'p99_us':micros(percentile(latencies, 99)),
+        'max_us':micros(percentile(latencies, 100)),
+    }
+
+
+def readSample(path=None):
+    f = open(path or os.path.join(DATA_PATH, 'sample.csv'), 'rb')
+    locations = [row[0] for row in UnicodeReader(f)]
+    f.close()
+    return locations
+
+
+'''End-to-end throughput and latency of guess.'''
+def benchGuess(cg, locations, repeat=3):
+    latencies = []
+    start = time.time()
+    with quiet():
+        for _ in range(repeat):
+            for location in locations:
+                t = time.time()
+                cg.guess(location)
+                latencies.append(time.time() - t)
+    return summary(latencies, time.time() - start)
+
+
+'''The rules of apply_rules, as (label, function of a LocationAnalysis).'''
+def ruleFunctions(cg):
+    rule = lambda name: getattr(cg, '_CountryGuesser__' + name)
+    searchState = rule('searchState')
+    searchStateAbbrevEnd = rule('searchStateAbbrevEnd')
+    functions = [
+        ('searchCountry', rule('searchCountry')),
+        ('searchState', lambda l: [searchState(l, cg.usaStatesIndex),
+                                   searchState(l, cg.canadaProvincesIndex),
+                                   searchState(l, cg.brazilStatesIndex)]),
+        ('searchStateAbbrevEnd', lambda l: [searchStateAbbrevEnd(l, cg.USAStates.abbrevsSet),
+                                            searchStateAbbrevEnd(l, cg.CanadaProvinces.abbrevsSet),
+                                            searchStateAbbrevEnd(l, cg.BrazilStates.abbrevsSet)]),
+        ('searchTLD', lambda l: searchStateAbbrevEnd(l, cg.WorldCountries.tldsSet)),
+        ('searchLargeCity', rule('searchLargeCity')),
+        ('searchAnyCity', rule('searchAnyCity')),
+        ('searchPostCode', rule('searchPostCode')),
+    ]
+    if cg.fuzzyIndex is not None:
+        functions.append(('searchFuzzy', rule('searchFuzzy')))
+    return functions
+
+
+'''Time every rule separately over the (analysed) locations.'''
+def benchRules(cg, locations, repeat=3):
+    analyses = [LocationAnalysis(cg.normalize(location)) for location in locations]
+    results = {}
+    with quiet():
+        for (label, f) in ruleFunctions(cg):
+            latencies = []
+            start = time.time()
+            for _ in range(repeat):
+                for analysis in analyses:
+                    t = time.time()
+                    f(analysis)
+                    latencies.append(time.time() - t)
+            results[label] = summary(latencies, time.time() - start)
+    return results
+
+
+'''The city names and the (comma-separated) lists of alternative names
+of the first rows of the GeoNames data.'''
+def readCityNames(rows=20000):
+    f = open(os.path.join(DATA_PATH, 'cities1000.csv'), 'rb')
+    names = []
+    alternatives = []
+    for (i, row) in enumerate(UnicodeReader(f)):
+        if i >= rows:
+            break
+        names.append(row[2])
+        alternatives.append(row[3])
+    f.close()
+    return names, alternatives
+
+
+'''Compare normalization with unidecode(s).lower().strip(), for speed and
+identical output: normalize on single strings, or normalizeAll on lists
+of names (lists=True). The cache is cleared first, so repeated strings
+are what it gains on.'''
+def benchNormalize(strings, repeat=3, lists=False):
+    if lists:
+        old = lambda s: [unidecode(a).lower().strip() for a in s.split(',')]
+        new = normalization.normalizeAll
+    else:
+        old = lambda s: unidecode(s).lower().strip()
+        new = normalization.normalize
+    results = {}
+    t = time.time()
+    for _ in range(repeat):
+        expected = [old(s) for s in strings]
+    results['unidecode'] = time.time() - t
+    normalization.clearCache()
+    t = time.time()
+    for _ in range(repeat):
+        actual = [new(s) for s in strings]
+    results['normalize'] = time.time() - t
+    results['strings'] = len(strings)
+    results['mismatches'] = len([1 for (a, b) in zip(expected, actual) if a != b])
+    return results
+
+
+'''Time constructing each dataset from the CSV files; also restricted to
+scope (countries and regions, see RegionScope), if given.'''
+def benchLoaders(scope=None):
+    loaders = [
+        ('USAStates', USAStates),
+        ('BrazilStates', BrazilStates),
+        ('CanadaProvinces', CanadaProvinces),
+        ('WorldCountries', WorldCountries),
+        ('BlackList', BlackList),
+        ('PostCodes', PostCodes),
+        ('WorldCities', lambda: WorldCities(4, 100000)),
+    ]
+    results = {}
+    loaded = {}
+    with quiet():
+        for (label, loader) in loaders:
+            t = time.time()
+            loaded[label] = loader()
+            results[label] = time.time() - t
+        t = time.time()
+        CityMatcher(loaded['WorldCities'])
+        results['CityMatcher'] = time.time() - t
+        # Startup as seen by users, i.e., from the snapshot if it is fresh.
+        # The registry is emptied before each timed startup: the guessers
+        # made before would otherwise hand over their data
+        dataRegistry.clear()
+        t = time.time()
+        CountryGuesser()
+        results['CountryGuesser'] = time.time() - t
+        # Startup with the memory-mapped city index
+        dataRegistry.clear()
+        t = time.time()
+        CountryGuesser(mapped=MAPPED_PATH)
+        results['CountryGuesser (mapped)'] = time.time() - t
+        if scope is not None:
+            t = time.time()
+            cities = WorldCities(4, 100000, scope=RegionScope(scope))
+            results['WorldCities (scope)'] = time.time() - t
+            t = time.time()
+            CityMatcher(cities)
+            results['CityMatcher (scope)'] = time.time() - t
+            dataRegistry.clear()
+            t = time.time()
+            CountryGuesser(scope=scope)
+            results['CountryGuesser (scope)'] = time.time() - t
+    return results
+
+
+'''Compare the guesses for sample.csv with results.csv. Returns the
+number of rows compared and the list of (location, expected, actual)
+for the rows that differ.'''
+def checkAccuracy(cg, samplePath=None, resultsPath=None):
+    f = open(resultsPath or os.path.join(DATA_PATH, 'results.csv'), 'rb')
+    expected = [row for row in UnicodeReader(f)]
+    f.close()
+    locations = readSample(samplePath)
+
+    mismatches = []
+    with quiet():
+        for location, row in zip(locations, expected):
+            # results.csv was written with None as 'None'
+            actual = [unicode(c) for c in cg.guess(location)]
+            if actual != row[1:]:
+                mismatches.append((location, row[1:], actual))
+    return len(locations), mismatches
+
+
+'''Compare the lazy and exhaustive evaluation modes of guess. Returns the
+list of (location, lazy answer, exhaustive answer) that differ.'''
+def checkModes(cg, locations):
+    lazy = cg.lazy
+    mismatches = []
+    with quiet():
+        for location in locations:
+            cg.lazy = True
+            a = cg.guess(location)
+            cg.lazy = False
+            b = cg.guess(location)
+            if a != b:
+                mismatches.append((location, a, b))
+    cg.lazy = lazy
+    return mismatches
+
+
+'''The (country, rule) candidates of the locations, with all rules and
+as in lazy mode.'''
+def readCandidates(cg, locations):
+    candidates = []
+    with quiet():
+        for location in locations:
+            location_norm = cg.normalize(location)
+            candidates.append(cg.apply_rules(location_norm, lazy=False))
+            candidates.append(cg.apply_rules(location_norm, lazy=True))
+    return candidates
+
+
+'''Compare the decision table with the cascade it replaces. Returns the
+list of (candidates, table decision, cascade decision) that differ.'''
+def checkDecisions(cg, candidates):
+    cascade = getattr(cg, '_CountryGuesser__decideCascade')
+    mismatches = []
+    for c in candidates:
+        # Same set for both: the order of the countries of a tie on the
+        # country rule depends on the order of iteration over it
+        c = set(c)
+        a = cg.decisionTable.decide(c)
+        b = cascade(c)
+        if a != b:
+            mismatches.append((sorted(c), a, b))
+    return mismatches
+
+
+'''Time the decision step alone, table vs cascade, over the candidates.'''
+def benchDecide(cg, candidates, repeat=3):
+    cascade = getattr(cg, '_CountryGuesser__decideCascade')
+    results = {}
+    # The cascade modifies its candidates: give it copies, made up front
+    copies = [[set(c) for c in candidates] for _ in range(repeat)]
+    t = time.time()
+    for r in range(repeat):
+        for c in copies[r]:
+            cascade(c)
+    results['cascade'] = time.time() - t
+    t = time.time()
+    for _ in range(repeat):
+        for c in candidates:
+            cg.decisionTable.decide(c)
+    results['table'] = time.time() - t
+    results['calls'] = repeat * len(candidates)
+    return results
+
+
+'''Time guess_column against Series.apply(guess) over a column of copies
+of the locations, shuffled. Returns None without pandas.'''
+def benchColumn(cg, locations, copies=20):
+    if columnGuesser.pandas is None:
+        return None
+    import random
+    rows = locations * copies
+    random.Random(0).shuffle(rows)
+    column = columnGuesser.pandas.Series(rows)
+    results = {'rows':len(rows)}
+    with quiet():
+        cg.clear_cache()
+        t = time.time()
+        expected = column.apply(cg.guess)
+        results['apply'] = time.time() - t
+        t = time.time()
+        answers = cg.guess_column(column)
+        results['column'] = time.time() - t
+    results['mismatches'] = len([1 for (e, c) in zip(expected, answers['countries'])
+                                 if tuple([x for x in e if x is not None]) != c])
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark CountryGuesser.')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='passes over sample.csv (default: 3)')
+    parser.add_argument('--skip-loaders', action='store_true',
+                        help='do not time loading the datasets')
+    parser.add_argument('--fuzzy', action='store_true',
+                        help='enable the fuzzy rule (typos)')
+    parser.add_argument('--scope',
+                        help='also time loading only these countries/regions (comma-separated)')
+    parser.add_argument('--json',
+                        help='also write the report to this file')
+    args = parser.parse_args(argv)
+
+    report = {}
+    with quiet():
+        cg = CountryGuesser(fuzzy=args.fuzzy)
+    locations = readSample()
+
+    if not args.skip_loaders:
+        report['loaders'] = benchLoaders(args.scope)
+        print 'Loading (seconds)'
+        for label, seconds in sorted(report['loaders'].items()):
+            print '  %-20s %8.3f' % (label, seconds)
+
+    report['guess'] = benchGuess(cg, locations, args.repeat)
+    g = report['guess']
+    print 'guess: %d calls, %.0f/s, p50 %.0fus, p90 %.0fus, p99 %.0fus, max %.0fus' % \
+        (g['calls'], g['per_second'], g['p50_us'], g['p90_us'], g['p99_us'], g['max_us'])
+
+    names, alternatives = readCityNames()
+    report['normalize'] = {'sample':benchNormalize(locations, args.repeat),
+                           'city names':benchNormalize(names, args.repeat),
+                           'alternative names':benchNormalize(alternatives, args.repeat, lists=True)}
+    print 'Normalisation (seconds, unidecode vs normalize)'
+    for label, r in sorted(report['normalize'].items()):
+        print '  %-20s %7.3f %7.3f  %d of %d identical' % (label, r['unidecode'], r['normalize'],
+                                                          r['strings'] - r['mismatches'], r['strings'])
+
+    report['rules'] = benchRules(cg, locations, args.repeat)
+    print 'Rules (microseconds per call)'
+    for label, r in sorted(report['rules'].items(), key=lambda e:-e[1]['seconds']):
+        print '  %-20s total %7.3fs  p50 %7.1f  p99 %7.1f' % (label, r['seconds'], r['p50_us'], r['p99_us'])
+
+    total, mismatches = checkAccuracy(cg)
+    report['accuracy'] = {'rows':total, 'mismatches':len(mismatches)}
+    print 'Accuracy: %d of %d rows match results.csv' % (total - len(mismatches), total)
+    for (location, expected, actual) in mismatches[:10]:
+        print '  %r: expected %r, got %r' % (location, expected, actual)
+
+    candidates = readCandidates(cg, locations)
+    report['decide'] = benchDecide(cg, candidates, args.repeat)
+    mismatches = checkDecisions(cg, candidates)
+    report['decide']['mismatches'] = len(mismatches)
+    d = report['decide']
+    print 'Decision: table %.3fs, cascade %.3fs for %d calls; %d of %d decisions agree' % \
+        (d['table'], d['cascade'], d['calls'], len(candidates) - len(mismatches), len(candidates))
+    for (c, table, cascade) in mismatches[:10]:
+        print '  %r: table %r, cascade %r' % (c, table, cascade)
+
+    report['column'] = benchColumn(cg, locations)
+    c = report['column']
+    if c is None:
+        print 'Column: pandas is not installed'
+    else:
+        print 'Column of %d rows: guess_column %.3fs, apply(guess) %.3fs; %d mismatches' % \
+            (c['rows'], c['column'], c['apply'], c['mismatches'])
+
+    mismatches = checkModes(cg, locations)
+    report['accuracy']['mode_mismatches'] = len(mismatches)
+    print 'Lazy vs exhaustive: %d of %d rows agree' % (len(locations) - len(mismatches), len(locations))
+    for (location, lazy, exhaustive) in mismatches[:10]:
+        print '  %r: lazy %r, exhaustive %r' % (location, lazy, exhaustive)
+
+    if args.json:
+        f = open(args.json, 'wb')
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.close()
+    return report
+
+
+if __name__=="__main__":
+    main()
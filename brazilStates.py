@@ -17,7 +17,7 @@ You should have received a copy of the GNU Lesser General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>."""
 
 import os
-from unidecode import unidecode
+from normalization import normalize
 from unicodeManager import UnicodeReader
 
 this_dir, this_filename = os.path.split(__file__)
@@ -34,7 +34,7 @@ class BrazilStates:
         reader = UnicodeReader(f)
         header = reader.next()
         for row in reader:
-            name = unidecode(row[0]).lower().strip()
+            name = normalize(row[0])
             abbrev = row[1].lower().strip()
             self.abbrevsSet.add(abbrev)
             self.abbrev2name[abbrev] = name
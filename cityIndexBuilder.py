@@ -0,0 +1,452 @@
+# This Python file uses the following encoding: utf-8
+
+"""Copyright 2014 Bogdan Vasilescu
+Eindhoven University of Technology
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+# Reads a GeoNames dump for WorldCities: data/cities1000.csv, or larger
+# extracts such as cities500.txt or allCountries.txt from
+# http://download.geonames.org/export/dump/
+#
+#   python cityIndexBuilder.py allCountries.txt --workers 8 --snapshot
+#
+# writes the snapshot CountryGuesser(cities='allCountries.txt') loads (see
+# indexSnapshot; --mapped for a mapped index, see mappedIndex).
+#
+# The file is streamed in chunks of lines. With workers > 1, the work is
+# spread over a pool of processes in two rounds:
+#  - each chunk is parsed and transliterated, and its names are written to
+#    a temporary file, grouped by their first two characters
+#  - the groups are divided into ranges, and the postings of each range
+#    are merged (in file order) and laid out as arrays; the ranges follow
+#    the sorted order of the names, so their arrays are simply appended
+# This process only reads the lines and appends the arrays, so the build
+# time goes down with the number of cores. Only a few chunks are in
+# flight at a time, so memory use does not grow with the size of the dump.
+# The index is the same for any number of workers.
+#
+# Rows are split on line boundaries, so fields must not contain line
+# breaks (GeoNames never quotes them).
+
+import os
+import gc
+import csv
+import sys
+import time
+import shutil
+import marshal
+import argparse
+import tempfile
+import itertools
+import collections
+import multiprocessing
+from array import array
+
+from normalization import normalize, normalizeAll
+
+this_dir, this_filename = os.path.split(__file__)
+DATA_PATH = os.path.join(this_dir, 'data')
+
+CITIES_PATH = os.path.join(DATA_PATH, 'cities1000.csv')
+
+# Lines parsed per task
+CHUNK_LINES = 20000
+
+# Ranges of names merged per worker (more ranges balance the load better)
+RANGES_PER_WORKER = 4
+
+# Columns of the GeoNames dump
+COL_NAME = 2
+COL_ALTERNATIVES = 3
+COL_FEATURE_CLASS = 6
+COL_COUNTRY_CODE = 8
+COL_POPULATION = 14
+
+# Feature class of cities, villages, ...; allCountries also lists
+# mountains, rivers, etc. The cities files leave it empty or set it to P.
+POPULATED_PLACE = 'P'
+
+# Examples kept per unknown country code
+MAX_EXAMPLES = 5
+
+# Set in each process parsing chunks: (tld2name, blackList, delimiter,
+# scope), scope being a RegionScope or None
+_context = None
+
+
+def _initParser(tld2name, blackList, delimiter, scope=None):
+    global _context
+    _context = (tld2name, blackList, delimiter, scope)
+
+
+def _initWorker(tld2name, blackList, delimiter, scope=None):
+    # The workers build large structures without cycles; collecting
+    # garbage while they do only slows them down
+    gc.disable()
+    _initParser(tld2name, blackList, delimiter, scope)
+
+
+'''Parse the lines of a chunk. Returns (countries, city2postings, unknown,
+rows): the countries in order of first occurrence, name -> [[(country,
+population), name length]] in file order, and code -> [rows, examples]
+for the country codes missing from countries.csv. Rows of cities the
+scope does not keep are skipped before anything else.'''
+def _parseChunk(lines):
+    tld2name, blackList, delimiter, scope = _context
+    if delimiter == '\t':
+        reader = csv.reader(lines, delimiter=delimiter, quoting=csv.QUOTE_NONE)
+    else:
+        reader = csv.reader(lines, delimiter=delimiter)
+
+    countries = []
+    seen = set()
+    city2postings = {}
+    unknown = {}
+    rows = 0
+    for row in reader:
+        rows += 1
+        if row[COL_FEATURE_CLASS] not in ('', POPULATED_PLACE):
+            continue
+        if scope is not None and not scope.keeps(row[COL_COUNTRY_CODE].lower(), int(row[COL_POPULATION])):
+            continue
+        city = normalize(unicode(row[COL_NAME], 'utf-8'))
+        if not len(city) or blackList.has_key(city):
+            continue
+        population = int(row[COL_POPULATION])
+        # Country 2-letter code
+        code = row[COL_COUNTRY_CODE].lower()
+        country = tld2name.get(code)
+        if country is None:
+            # Not all possible 2-letter country codes are known in
+            # countries.csv. If necessary, add manually and rebuild
+            report = unknown.setdefault(code, [0, []])
+            report[0] += 1
+            if len(report[1]) < MAX_EXAMPLES:
+                report[1].append((city, population))
+            continue
+        if country not in seen:
+            seen.add(country)
+            countries.append(country)
+
+        # Alternative names/spellings for the same city
+        alternatives = [a for a in normalizeAll(unicode(row[COL_ALTERNATIVES], 'utf-8'))
+                        if len(a)
+                        and not blackList.has_key(a)]
+        posting = (country, population)
+
+        # Note: Two cities with the same name in different countries
+        # or even two cities with the same name in the same country
+        # are recorded separately
+        # Record same country for all alternative names of this city
+        for name in [city] + alternatives:
+            _addPosting(city2postings.setdefault(name, []), posting, min(len(name), len(city), 255))
+    return (countries, city2postings, unknown, rows)
+
+
+def _addPosting(postings, posting, length):
+    for entry in postings:
+        if entry[0] == posting:
+            # Same country and population: the posting counts as soon
+            # as one main name is long enough
+            entry[1] = max(entry[1], length)
+            return
+    postings.append([posting, length])
+
+
+'''Add the postings of a later chunk (city2postings) to target.'''
+def _mergePostings(target, city2postings):
+    for name, entries in city2postings.iteritems():
+        postings = target.get(name)
+        if postings is None:
+            target[name] = entries
+        else:
+            for (posting, length) in entries:
+                _addPosting(postings, posting, length)
+
+
+'''Lay out merged postings as in WorldCities: returns the sorted names,
+and the offsets and postings arrays.'''
+def _layout(city2postings, country2id):
+    names = sorted(city2postings.iterkeys())
+    offsets = array('i', [0])
+    postingCountries = array('H')
+    postingPopulations = array('i')
+    postingNameLengths = array('B')
+    for name in names:
+        # Stable sort: equally large cities stay in data file order
+        for ((country, population), length) in sorted(city2postings[name], key=lambda e:-e[0][1]):
+            postingCountries.append(country2id[country])
+            postingPopulations.append(population)
+            postingNameLengths.append(length)
+        offsets.append(len(postingCountries))
+    return (names, offsets, postingCountries, postingPopulations, postingNameLengths)
+
+
+'''First round: parse a chunk and write its postings to path, grouped by
+the first two characters of the names. Returns what _parseChunk does,
+with instead of the postings the position of each group in the file.'''
+def _parseToFile((path, lines)):
+    (countries, city2postings, unknown, rows) = _parseChunk(lines)
+    groups = {}
+    for name, postings in city2postings.iteritems():
+        groups.setdefault(name[:2], {})[name] = postings
+    index = {}
+    f = open(path, 'wb')
+    for prefix in sorted(groups):
+        data = marshal.dumps(groups[prefix])
+        index[prefix] = (f.tell(), len(data))
+        f.write(data)
+    f.close()
+    return (countries, index, unknown, rows)
+
+
+'''Second round: merge the groups of prefixes from the files of all
+chunks (in file order), given as [(path, index)]. Returns the layout as
+strings, which are cheap to send back.'''
+def _mergeRange((prefixes, chunks, country2id)):
+    city2postings = {}
+    for (path, index) in chunks:
+        f = open(path, 'rb')
+        for prefix in prefixes:
+            if prefix in index:
+                (offset, length) = index[prefix]
+                f.seek(offset)
+                _mergePostings(city2postings, marshal.loads(f.read(length)))
+        f.close()
+    (names, offsets, countries, populations, lengths) = _layout(city2postings, country2id)
+    return ('\n'.join(names), offsets.tostring(), countries.tostring(),
+            populations.tostring(), lengths.tostring())
+
+
+class CityIndexBuilder:
+    '''Builds the postings of WorldCities from a GeoNames dump. countries
+    (WorldCountries) resolves the country codes; blackList is a dict of
+    names to leave out.
+
+    After build: countries lists the country names (ids) in order of
+    first occurrence, names the sorted city names (ids), and offsets and
+    postingCountries, postingPopulations and postingNameLengths the
+    postings, as in WorldCities. unknownCodes maps each country code
+    missing from countries.csv to [rows, examples of (city, population)];
+    those rows are left out. scope is an optional RegionScope: only the
+    cities it keeps are loaded.'''
+
+    def __init__(self, countries, blackList, workers=1, chunk_lines=CHUNK_LINES, scope=None):
+        self.tld2name = countries.tld2name
+        self.blackList = blackList
+        self.scope = scope
+        self.workers = workers
+        self.chunk_lines = chunk_lines
+
+        self.countries = []
+        self.names = []
+        self.offsets = array('i', [0])
+        self.postingCountries = array('H')
+        self.postingPopulations = array('i')
+        self.postingNameLengths = array('B')
+        self.unknownCodes = {}
+        self.rows = 0
+
+
+    def __chunks(self, f):
+        while True:
+            lines = list(itertools.islice(f, self.chunk_lines))
+            if not len(lines):
+                break
+            yield lines
+
+
+    def __count(self, countries, unknown, rows):
+        self.rows += rows
+        for country in countries:
+            if country not in self.countries:
+                self.countries.append(country)
+        for code, (rows, examples) in unknown.iteritems():
+            report = self.unknownCodes.setdefault(code, [0, []])
+            report[0] += rows
+            report[1].extend(examples[:MAX_EXAMPLES - len(report[1])])
+
+
+    def __country2id(self):
+        return dict([(country, i) for (i, country) in enumerate(self.countries)])
+
+
+    '''Read the dump at path (fields separated by delimiter: ';' for the
+    files in data/, tab for the GeoNames downloads).'''
+    def build(self, path=CITIES_PATH, delimiter=';'):
+        # No cycles to collect among the many containers built here
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        f = open(path, 'rb')
+        try:
+            if self.workers <= 1:
+                self.__build(f, delimiter)
+            else:
+                self.__buildParallel(f, delimiter)
+        finally:
+            f.close()
+            if gc_enabled:
+                gc.enable()
+        return self
+
+
+    def __build(self, f, delimiter):
+        _initParser(self.tld2name, self.blackList, delimiter, self.scope)
+        city2postings = {}
+        for lines in self.__chunks(f):
+            (countries, postings, unknown, rows) = _parseChunk(lines)
+            self.__count(countries, unknown, rows)
+            _mergePostings(city2postings, postings)
+        (self.names, self.offsets, self.postingCountries, self.postingPopulations,
+         self.postingNameLengths) = _layout(city2postings, self.__country2id())
+
+
+    def __buildParallel(self, f, delimiter):
+        tmp_dir = tempfile.mkdtemp(prefix='cityIndex')
+        pool = multiprocessing.Pool(self.workers, _initWorker,
+                                    (self.tld2name, self.blackList, delimiter, self.scope))
+        try:
+            # First round; keep every worker busy, with one chunk waiting each
+            chunks = []
+            sizes = collections.defaultdict(int)
+            pending = collections.deque()
+            def collect():
+                (path, result) = pending.popleft()
+                (countries, index, unknown, rows) = result.get()
+                self.__count(countries, unknown, rows)
+                chunks.append((path, index))
+                for prefix, (_, length) in index.iteritems():
+                    sizes[prefix] += length
+            for (i, lines) in enumerate(self.__chunks(f)):
+                path = os.path.join(tmp_dir, '%d' % i)
+                pending.append((path, pool.apply_async(_parseToFile, ((path, lines),))))
+                if len(pending) >= 2 * self.workers:
+                    collect()
+            while len(pending):
+                collect()
+
+            # Second round, over ranges of prefixes of similar sizes
+            country2id = self.__country2id()
+            target = sum(sizes.itervalues()) / (RANGES_PER_WORKER * self.workers) + 1
+            ranges = [[]]
+            size = 0
+            for prefix in sorted(sizes):
+                if size >= target:
+                    ranges.append([])
+                    size = 0
+                ranges[-1].append(prefix)
+                size += sizes[prefix]
+            tasks = [(prefixes, chunks, country2id) for prefixes in ranges]
+            for (names, offsets, countries, populations, lengths) in pool.imap(_mergeRange, tasks):
+                if not len(names):
+                    continue
+                self.names.extend(names.split('\n'))
+                base = len(self.postingCountries)
+                offsets = array('i', offsets)
+                self.offsets.extend(array('i', [offset + base for offset in offsets[1:]]))
+                self.postingCountries.fromstring(countries)
+                self.postingPopulations.fromstring(populations)
+                self.postingNameLengths.fromstring(lengths)
+        finally:
+            pool.terminate()
+            pool.join()
+            shutil.rmtree(tmp_dir, True)
+
+
+    '''Lines describing the unknown country codes, if any.'''
+    def report(self):
+        lines = []
+        for code, (rows, examples) in sorted(self.unknownCodes.iteritems()):
+            lines.append('UNKNOWN CODE: %r (%d rows, e.g., %s)' % (code, rows,
+                         ', '.join(['%s %d' % (city.encode('utf-8'), population)
+                                    for (city, population) in examples])))
+        return lines
+
+
+class CitySource:
+    '''The GeoNames dump the city index is built from: path, with fields
+    separated by delimiter (None: a tab for the .txt downloads of GeoNames,
+    ';' otherwise), parsed by workers processes in chunks of chunk_lines
+    (see CityIndexBuilder). The index only depends on the dump, so path
+    identifies a source; name (the file name without extension) tells
+    the prebuilt indexes of several dumps apart.'''
+
+    def __init__(self, path=CITIES_PATH, delimiter=None, workers=1, chunk_lines=CHUNK_LINES):
+        if delimiter is None:
+            delimiter = '\t' if path.endswith('.txt') else ';'
+        self.path = os.path.abspath(path)
+        self.delimiter = delimiter
+        self.workers = workers
+        self.chunk_lines = chunk_lines
+        self.name = os.path.splitext(os.path.basename(path))[0]
+
+
+    '''True for data/cities1000.csv, the dump of the defaults.'''
+    def isDefault(self):
+        return self.path == os.path.abspath(CITIES_PATH)
+
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(description='Build the city index from a GeoNames dump.')
+    parser.add_argument('path', nargs='?', default=CITIES_PATH,
+                        help='the dump (default: data/cities1000.csv)')
+    parser.add_argument('--delimiter',
+                        help='field separator, or "tab" (default: tab for .txt files, ; otherwise)')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+                        help='parsing processes (default: one per core)')
+    parser.add_argument('--chunk-lines', type=int, default=CHUNK_LINES,
+                        help='lines parsed per task (default: %d)' % CHUNK_LINES)
+    parser.add_argument('--scope',
+                        help='only the cities of these countries and regions, and the big cities of the others')
+    written = parser.add_mutually_exclusive_group()
+    written.add_argument('--snapshot', nargs='?', const='',
+                         help='write the snapshot of CountryGuesser (default: data/index.snapshot)')
+    written.add_argument('--mapped', nargs='?', const='',
+                         help='write the mapped index of CountryGuesser (default: data/index.mmap)')
+    args = parser.parse_args(argv)
+    if args.delimiter == 'tab':
+        args.delimiter = '\t'
+    return args
+
+
+if __name__=="__main__":
+    args = parseArgs(sys.argv[1:])
+    from regionScope import RegionScope
+    source = CitySource(args.path, args.delimiter, args.workers, args.chunk_lines)
+    scope = RegionScope(args.scope) if args.scope else None
+
+    start = time.time()
+    if args.snapshot is None and args.mapped is None:
+        from worldCities import WorldCities
+        cities = WorldCities(path=source.path, delimiter=source.delimiter, workers=source.workers,
+                             chunk_lines=source.chunk_lines, scope=scope)
+        print len(cities.name2id), 'city names,', len(cities.postingCountries), 'postings from', \
+            cities.rows, 'rows in', round(time.time() - start, 2), 's with', args.workers, 'workers'
+    else:
+        # Built (and written) by the guesser, as it would itself
+        import indexSnapshot
+        from countryGuesser import CountryGuesser
+        from mappedIndex import MAPPED_PATH
+        if args.snapshot == '':
+            args.snapshot = indexSnapshot.SNAPSHOT_PATH
+        if args.mapped == '':
+            args.mapped = MAPPED_PATH
+        path, _ = indexSnapshot.locate(args.snapshot or args.mapped, scope, source)
+        if os.path.exists(path):
+            os.remove(path)
+        CountryGuesser(snapshot=args.snapshot, mapped=args.mapped, scope=scope, cities=source)
+        if os.path.exists(path):
+            print path, 'written (%d bytes) in' % os.path.getsize(path), round(time.time() - start, 2), \
+                's with', args.workers, 'workers'
@@ -0,0 +1,70 @@
+# This Python file uses the following encoding: utf-8
+
+"""Copyright 2014 Bogdan Vasilescu
+Eindhoven University of Technology
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+from ahoCorasick import AhoCorasick
+
+
+def removeSubstrings(listOfStrings):
+    # Only return those elements that are not contained in another element
+    # ['paris', 'saint-marc', 'saint-marcel']
+    # ['paris', 'saint-marcel']
+    strings = set(listOfStrings)
+    withoutSubstrings = set()
+    for s in strings:
+        if not any(s in o for o in strings if o != s):
+            withoutSubstrings.add(s)
+    return sorted(withoutSubstrings)
+
+
+class CityMatcher:
+    '''Finds city names inside a normalised location string. All the names
+    known to WorldCities are compiled once into an Aho-Corasick automaton,
+    so each location is scanned in a single pass. The population and name
+    length thresholds are applied per search, so guessers with different
+    thresholds can share one matcher.'''
+
+    def __init__(self, cities, automaton=None):
+        self.cities = cities
+        # A prebuilt automaton over the same names can be passed in, e.g.,
+        # one mapped from an index file (see mappedIndex)
+        if automaton is None:
+            automaton = AhoCorasick(cities.names())
+        self.automaton = automaton
+
+
+    '''Return the city names occurring in location_norm that contain at least
+    one of the given parts, without the names that are substrings of other
+    names found. Only cities with population >= min_population and names
+    of at least min_length characters are considered. overlay is an
+    optional GazetteerOverlay changing the cities.'''
+    def search(self, location_norm, parts, min_population=0, min_length=0, overlay=None):
+        # Pattern ids are name ids of WorldCities (both follow sorted order)
+        patterns = self.automaton.patterns
+        found = [patterns[i] for i in self.automaton.findIds(location_norm)
+                 if self.cities.hasCityId(i, min_population, min_length)]
+        if overlay is not None and not overlay.empty:
+            found = overlay.filterCities(found, location_norm, self.cities, min_population, min_length)
+        candidates = [city for city in found if any(p in city for p in parts)]
+        return removeSubstrings(candidates)
+
+
+if __name__=="__main__":
+    from worldCities import WorldCities
+    matcher = CityMatcher(WorldCities())
+    print len(matcher.automaton), 'city names in the automaton'
+    print matcher.search('eindhoven, the netherlands', ['eindhoven', 'netherlands'], 100000, 4)
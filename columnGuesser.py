@@ -0,0 +1,126 @@
+# This Python file uses the following encoding: utf-8
+
+"""Copyright 2014 Bogdan Vasilescu
+Eindhoven University of Technology
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+# Locations held in pandas columns, resolved column by column instead of
+# row by row (frame['location'].apply(cg.guess)):
+#
+#   answers = cg.guess_column(frame['location'])
+#   frame['country'] = answers['country']
+#
+# The work follows the number of distinct locations, not of rows:
+#  - the column is factorised, and each distinct string normalised once
+#  - the normalised strings are factorised again ("Paris" and "paris ")
+#  - a prefilter, vectorised over the distinct strings, answers those
+#    that no rule can match (without letters or digits) directly
+#  - the others are resolved once each (CountryGuesser.explain_many)
+#  - the answers are broadcast back to the rows through the codes of the
+#    factorisation, as categorical columns
+# Needs pandas (and numpy); the rest of the package does not.
+
+try:
+    import numpy
+    import pandas
+except ImportError:
+    numpy = pandas = None
+
+from regionScope import OTHER
+
+# The characters some rule needs: every name the rules look for has
+# letters, and every post code format a digit
+RULE_CHARACTERS = r'[A-Za-z0-9]'
+
+
+'''Boolean array telling which of the normalised strings (values) may be
+matched by some rule; the others have no candidates.'''
+def needsRules(values):
+    if not len(values):
+        return numpy.zeros(0, dtype=bool)
+    return pandas.Series(values, dtype=object).str.contains(RULE_CHARACTERS).values
+
+
+'''The countries for a column of locations, as a DataFrame with the index
+of the column (a Series; any sequence gets a default index), and the
+columns:
+
+    country    the first country of the answer of guess (categorical)
+    countries  all countries of the answer, as a tuple (empty if none)
+    decision   the label of the decision branch (categorical)
+
+Missing values (None, NaN) get a missing country and decision, and no
+countries (an empty tuple, as for the locations that resolve to
+nothing). The categories are all country names (and OTHER with a
+scope) and all decision labels, so the answers of several columns can
+be combined. workers, chunksize and pool are as in guess_many; only
+the distinct locations go to the workers. The prefilter bypasses the
+on_decision callback and the statistics.'''
+def guess_column(cg, column, workers=1, chunksize=100, pool=None):
+    if pandas is None:
+        raise ImportError('guess_column needs pandas and numpy')
+    if not isinstance(column, pandas.Series):
+        column = pandas.Series(list(column), dtype=object)
+
+    # Row -> distinct string (-1 if missing), and each one normalised once
+    codes, values = pandas.factorize(column)
+    normalized = [cg.normalize(value if isinstance(value, basestring) else unicode(value))
+                  for value in values]
+    # Distinct string -> distinct normalised location
+    normCodes, locations = pandas.factorize(numpy.array(normalized, dtype=object))
+    # Missing rows point past the end: the missing answer is appended there
+    rows = numpy.where(codes >= 0, numpy.append(normCodes, -1)[codes], len(locations))
+
+    if cg.overlay.empty:
+        survivors = needsRules(locations)
+    else:
+        # The overlay may add names of any kind
+        survivors = numpy.ones(len(locations), dtype=bool)
+    explanations = [([None], [], cg.decision_labels[cg.D_NONE])] * len(locations)
+    indices = numpy.flatnonzero(survivors)
+    explained = cg.explain_many([locations[i] for i in indices], workers, chunksize, pool)
+    for (i, explanation) in zip(indices, explained):
+        explanations[i] = explanation
+
+    # Answers per distinct location (and the missing answer last), as
+    # category codes, broadcast to the rows by indexing
+    countryNames = sorted(set(cg.WorldCountries.alternative2name.itervalues()))
+    if cg.scope is not None:
+        countryNames.append(OTHER)
+    countryIds = dict([(c, i) for (i, c) in enumerate(countryNames)])
+    decisionLabels = [cg.decision_labels[d] for d in sorted(cg.decision_labels)]
+    decisionIds = dict([(label, i) for (i, label) in enumerate(decisionLabels)])
+
+    countryCodes = numpy.empty(len(locations) + 1, dtype=numpy.int32)
+    decisionCodes = numpy.empty(len(locations) + 1, dtype=numpy.int32)
+    countries = numpy.empty(len(locations) + 1, dtype=object)
+    for (i, (answer, _, decision)) in enumerate(explanations):
+        countryCodes[i] = countryIds[answer[0]] if answer[0] is not None else -1
+        decisionCodes[i] = decisionIds[decision]
+        countries[i] = tuple([c for c in answer if c is not None])
+    countryCodes[-1] = decisionCodes[-1] = -1
+    countries[-1] = ()
+
+    return pandas.DataFrame({
+        'country': pandas.Categorical.from_codes(countryCodes[rows], countryNames),
+        'countries': countries[rows],
+        'decision': pandas.Categorical.from_codes(decisionCodes[rows], decisionLabels),
+    }, index=column.index, columns=['country', 'countries', 'decision'])
+
+
+if __name__=="__main__":
+    from countryGuesser import CountryGuesser
+    cg = CountryGuesser()
+    print cg.guess_column(['Eindhoven, NL', 'eindhoven, nl', None, '???', 'Paris', 'Paris'])
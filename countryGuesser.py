@@ -18,41 +18,79 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>."""
 
 import timing
 from time import clock
-from unidecode import unidecode
-import re
-import SuffixTree.SubstringDict
-from collections import Counter
+import normalization
+import copy
+import json
+import hashlib
+import multiprocessing
+from collections import Counter, OrderedDict
+from timeit import default_timer as timer
 
 
-from usaStates import USAStates
-from brazilStates import BrazilStates
-from canadaProvinces import CanadaProvinces
-from worldCountries import WorldCountries
 from worldCities import WorldCities
-from postCodes import PostCodes
+from cityIndexBuilder import CitySource
+from cityMatcher import CityMatcher
+# Defined here before cityMatcher; kept for imports from this module
+from cityMatcher import removeSubstrings
+import dataRegistry
+from lruCache import LRUCache
+from nameIndex import NameIndex
+from locationAnalysis import LocationAnalysis
+from decisionTable import DecisionTable
+from fuzzyIndex import FuzzyIndex
+from gazetteerOverlay import GazetteerOverlay
+import indexSnapshot
+from indexSnapshot import SNAPSHOT_PATH
+import mappedIndex
+from resultCache import ResultCache, RESULT_CACHE_VERSION
+from regionScope import RegionScope, OTHER
 
 
 
-def removeSubstrings(listOfStrings):
-    # Insert all strings into a suffix tree
-    std = SuffixTree.SubstringDict()
-    for s in listOfStrings:
-        std[s] = 1
-    withoutSubstrings = set()
-    for s in listOfStrings:
-        # Only return those elements for which there is no suffix
-        if len(std[s]) == 1:
-            withoutSubstrings.add(s)
-    return sorted(withoutSubstrings)
+# The guesser used by pool workers. Set in each worker as it starts (see
+# make_pool); the guesser is inherited through fork, so the workers share
+# its (already loaded) index copy-on-write instead of each loading their
+# own.
+_poolGuesser = None
+
+def _initWorker(guesser):
+    global _poolGuesser
+    _poolGuesser = guesser
+
+def _guessInWorker(location_norm):
+    return _poolGuesser.guess_normalized(location_norm)
+
+def _explainInWorker(location_norm):
+    return _poolGuesser.explain_normalized(location_norm)
 
 
 
 class CountryGuesser:
     
-    def __init__(self):
-        self.MIN_POPULATION = 100000
-        self.MIN_CITY_LENGTH = 4
+    '''The keyword arguments, and where more is said about them:
+
+    snapshot         prebuilt index, (re)written when stale; None builds from the CSV files (see indexSnapshot)
+    cache_size       normalised locations whose answers are memoised; None disables it (see lruCache)
+    stats            RuleStats collecting timings per rule and decision (see ruleStats)
+    on_decision      callback for every guess, e.g. report_unresolved
+    lazy             False runs all rules for every location (same answers, slower)
+    min_population   population from which a city counts as big (see with_thresholds)
+    min_city_length  minimum length of city names (see with_thresholds)
+    mapped           memory-mapped city index, used instead of the snapshot (see mappedIndex)
+    overlay          GazetteerOverlay, or the path of its delta file (see gazetteerOverlay)
+    cities           GeoNames dump of the cities: a CitySource, or its path (see cityIndexBuilder)
+    fuzzy            True also matches names with a typo (see fuzzyIndex)
+    result_cache     ResultCache, or its path, keeping the answers across runs (see resultCache)
+    scope            RegionScope, or its countries and regions, to load the cities of (see regionScope)'''
+    def __init__(self, snapshot=SNAPSHOT_PATH, cache_size=None, stats=None, on_decision=None, lazy=True,
+                 min_population=100000, min_city_length=4, mapped=None, overlay=None, cities=None,
+                 fuzzy=False, result_cache=None, scope=None):
+        self.MIN_POPULATION = min_population
+        self.MIN_CITY_LENGTH = min_city_length
         self.MIN_COUNTRY_LENGTH = 5
+        # Shorter tokens are too easily one typo away from some name
+        self.MIN_FUZZY_LENGTH = 5
+        self.FUZZY_DISTANCE = 1
         
         # Rule types
         self.R_COUNTRY = 0
@@ -62,6 +100,7 @@ class CountryGuesser:
         self.R_POST_CODE = 4
         self.R_TLD = 5
         self.R_STATE_ABBREV = 6
+        self.R_FUZZY = 7
         
         # Rule labels
         self.rule_labels = {
@@ -71,143 +110,282 @@ class CountryGuesser:
             self.R_ANY_CITY:'Any city',
             self.R_POST_CODE:'Post code',
             self.R_TLD:'TLD',
-            self.R_STATE_ABBREV:'State abbrev'
+            self.R_STATE_ABBREV:'State abbrev',
+            self.R_FUZZY:'Fuzzy'
         }
         
-        # Loading data
-        print "Loading data"
-        ##timing.log(clock())
+        # Decision branches of guess
+        self.D_NONE = 0
+        self.D_SINGLE = 1
+        self.D_MAJORITY = 2
+        self.D_BIG_CITY = 3
+        self.D_COUNTRY = 4
+        self.D_STATE_ABBREV = 5
+        self.D_STATE = 6
+        self.D_UNRESOLVED = 7
+        
+        # Decision labels
+        self.decision_labels = {
+            self.D_NONE:'No candidates',
+            self.D_SINGLE:'Single country',
+            self.D_MAJORITY:'Majority',
+            self.D_BIG_CITY:'Big city',
+            self.D_COUNTRY:'Country',
+            self.D_STATE_ABBREV:'State abbrev',
+            self.D_STATE:'State',
+            self.D_UNRESOLVED:'Unresolved'
+        }
         
-        self.USAStates = USAStates()
-        self.BrazilStates = BrazilStates()
-        self.CanadaProvinces = CanadaProvinces()
-        self.WorldCountries = WorldCountries()
-        self.WorldCities = WorldCities(self.MIN_CITY_LENGTH, self.MIN_POPULATION)
-        self.PostCodes = PostCodes()
+        # The decision logic of guess, compiled into table lookups
+        self.decisionTable = DecisionTable(self)
         
-        # Store the city names also as a suffix tree
-        print 'Creating suffix trees for city names'
-        ##timing.log(clock())
+        # Instrumentation (see RuleStats), and a hook called with
+        # (location_norm, candidates, countries, decision) for every guess
+        self.stats = stats
+        self.on_decision = on_decision
+        self.lazy = lazy
+        self.__initRules()
+        
+        # Loading data (only the cities of the countries in scope)
+        if scope is not None and not isinstance(scope, RegionScope):
+            scope = RegionScope(scope, dataRegistry.get('WorldCountries'), min_population)
+        self.scope = scope
+        if isinstance(cities, basestring):
+            cities = CitySource(cities)
+        self.citySource = cities
+        if mapped is not None:
+            data = self.__loadMapped(mapped)
+        else:
+            data = self.__loadSnapshot(snapshot)
+        
+        self.USAStates = data['USAStates']
+        self.BrazilStates = data['BrazilStates']
+        self.CanadaProvinces = data['CanadaProvinces']
+        self.WorldCountries = data['WorldCountries']
+        self.WorldCities = data['WorldCities']
+        self.cityMatcher = data['CityMatcher']
+        self.PostCodes = dataRegistry.get('PostCodes')
+        
+        # Country and state names, compiled for searching
+        self.countryIndex = NameIndex(self.WorldCountries.namesSet)
+        self.usaStatesIndex = NameIndex(self.USAStates.namesSet)
+        self.canadaProvincesIndex = NameIndex(self.CanadaProvinces.namesSet)
+        self.brazilStatesIndex = NameIndex(self.BrazilStates.namesSet)
+        
+        # Answers for recently seen (normalised) locations
+        self.cache = LRUCache(cache_size) if cache_size else None
         
-        # 1) Large cities
-        self.stdWorldCitiesLarge = SuffixTree.SubstringDict()
-        for city in self.WorldCities.largeCity2countryPopulation.iterkeys():
-            self.stdWorldCitiesLarge[city] = city
-        # 2) All cities
-        self.stdWorldCitiesAll = SuffixTree.SubstringDict()
-        for city in self.WorldCities.city2countryPopulation.iterkeys():
-            self.stdWorldCitiesAll[city] = city
+        # Additions to and removals from the index
+        if overlay is None or isinstance(overlay, basestring):
+            path = overlay
+            overlay = GazetteerOverlay(self.WorldCountries)
+            if path is not None:
+                overlay.load(path)
+        self.overlay = overlay
+        self.__overlayVersion = overlay.version
+        
+        # Names matched with typos, and their countries (optional)
+        self.fuzzyIndex = None
+        if fuzzy:
+            self.fuzzyCountries, self.fuzzyIndex = self.__buildFuzzyIndex()
+        
+        # Answers kept across runs (optional)
+        if isinstance(result_cache, basestring):
+            result_cache = ResultCache(result_cache)
+        self.resultCache = result_cache
+        self.__dataChecksum = None
+        self.__fingerprint = (None, None)
 
         print 'Done initialising'
         #timing.log(clock())
         
     
-    def __get_trailing_number(self, s):
-        m = re.search(r'\d+$', s)
-        return m.group() if m else None
-
-
-    '''Split a string into comma parts.'''
-    def __commaParts(self, location_norm):
-        return [p for p in [p.strip() for p in location_norm.split(',')] if len(p)]
+    '''Return a guesser with other city thresholds, sharing all loaded data
+    with this one (nothing is reloaded or rebuilt). It gets its own cache,
+    of the same size; None keeps the current value of a threshold.'''
+    def with_thresholds(self, min_population=None, min_city_length=None):
+        other = copy.copy(self)
+        if min_population is not None:
+            other.MIN_POPULATION = min_population
+        if min_city_length is not None:
+            other.MIN_CITY_LENGTH = min_city_length
+        other.cache = LRUCache(self.cache.size) if self.cache is not None else None
+        if self.fuzzyIndex is not None and (other.MIN_POPULATION, other.MIN_CITY_LENGTH) != \
+                (self.MIN_POPULATION, self.MIN_CITY_LENGTH):
+            # Which cities are big depends on the thresholds
+            other.fuzzyCountries, other.fuzzyIndex = other.__buildFuzzyIndex()
+        # The rules are bound methods of self; rebind them to the copy
+        other.__initRules()
+        return other
+        
+    
+    '''Load the lookup structures from the snapshot, or build them (and
+    write the snapshot) if it is missing or stale.'''
+    def __loadSnapshot(self, snapshot):
+        scope = self.scope
+        source = self.citySource
+        if dataRegistry.isLoaded('WorldCities', scope, source) and \
+                dataRegistry.isLoaded('CityMatcher', scope, source):
+            # Already loaded by another guesser in this process
+            data = self.__loadRegions()
+            data['WorldCities'] = dataRegistry.get('WorldCities', scope, source)
+            data['CityMatcher'] = dataRegistry.get('CityMatcher', scope, source)
+            return data
+        
+        data = None
+        if snapshot is not None:
+            # The index does not depend on the thresholds
+            snapshot, fingerprint = indexSnapshot.locate(snapshot, scope, source)
+            data = indexSnapshot.load(snapshot, fingerprint)
+        if data is None:
+            data = self.__buildIndex()
+            if snapshot is not None:
+                print 'Writing snapshot', snapshot
+                try:
+                    indexSnapshot.save(snapshot, fingerprint, data)
+                except (IOError, OSError), e:
+                    # E.g., read-only installation; just build again next time
+                    print 'Could not write snapshot:', e
+        else:
+            print 'Loaded snapshot', snapshot
+            # Share the loaded datasets with the rest of the process
+            for name in data:
+                data[name] = dataRegistry.provide(name, data[name], scope, source)
+        return data
+    
     
+    '''Load all data from the CSV files and compile the lookup structures.'''
+    def __buildIndex(self):
+        print "Loading data"
+        ##timing.log(clock())
+        
+        data = self.__loadRegions()
+        data['WorldCities'] = dataRegistry.get('WorldCities', self.scope, self.citySource)
+        
+        # Compile all city names into one automaton (large cities are a subset)
+        print 'Creating matcher for city names'
+        ##timing.log(clock())
+        data['CityMatcher'] = dataRegistry.get('CityMatcher', self.scope, self.citySource)
+        return data
     
-    '''Split a string into parts on any non-alphabetic character.'''
-    def __parts(self, location_norm):
-        return [p for p in re.split(r'[^A-Za-z]', location_norm) if len(p)]
     
+    '''The (small) country and state lists, shared within the process.'''
+    def __loadRegions(self):
+        data = {}
+        for name in ['USAStates', 'BrazilStates', 'CanadaProvinces', 'WorldCountries']:
+            data[name] = dataRegistry.get(name)
+        return data
     
-    '''Split a string into parts on any non-alphabetic character.
-    Substrings from the exceptions list do not get split.'''
-    def __partsWithoutSplitting(self, location_norm, exceptions):
-        cpy_location_norm = location_norm[:] #creates copy
-        parts = []
-        for word in exceptions:
-            if word in location_norm:
-                parts.append(word)
-                cpy_location_norm=cpy_location_norm.replace(word, ' ')
-        parts.extend( re.split(r'[^A-Za-z]', cpy_location_norm) )
-        return [p for p in parts if len(p)]
+    
+    '''Load the country and state lists from the CSV files, and map the
+    city index from path, building it first if necessary.'''
+    def __loadMapped(self, path):
+        source = self.citySource or CitySource()
+        path, fingerprint = indexSnapshot.locate(path, self.scope, source)
+        index = mappedIndex.load(path, fingerprint)
+        data = self.__loadRegions()
+        if index is None:
+            # Not registered: the point of mapping is not to keep these
+            print "Loading data"
+            cities = WorldCities(path=source.path, delimiter=source.delimiter, workers=source.workers,
+                                 chunk_lines=source.chunk_lines, scope=self.scope)
+            print 'Creating matcher for city names'
+            matcher = CityMatcher(cities)
+            print 'Writing mapped index', path
+            try:
+                mappedIndex.save(path, fingerprint, cities, matcher.automaton)
+            except (IOError, OSError), e:
+                # E.g., read-only installation; keep the data in memory
+                print 'Could not write mapped index:', e
+                data['WorldCities'] = cities
+                data['CityMatcher'] = matcher
+                return data
+            del cities, matcher
+            index = mappedIndex.load(path, fingerprint)
+        else:
+            print 'Mapped index', path
         
+        data['WorldCities'] = index.cities
+        data['CityMatcher'] = CityMatcher(index.cities, index.automaton)
+        return data
         
-    def __multiWords(self, strSet):
-        return [c for c in strSet if len(c.split())>1 or len(c.split('.'))>1]
+    
+    '''The country of each name the fuzzy rule knows (country and state
+    names, and big cities), and a FuzzyIndex of these names.'''
+    def __buildFuzzyIndex(self):
+        self.blackList = dataRegistry.get('BlackList').dict
+        alternative2name = self.WorldCountries.alternative2name
+        countries = {}
+        cities = self.WorldCities
+        # Ids follow the order of names()
+        for (i, city) in enumerate(cities.names()):
+            if len(city) >= self.MIN_FUZZY_LENGTH and cities.hasCityId(i, self.MIN_POPULATION, self.MIN_CITY_LENGTH):
+                country = cities.postingsById(i, self.MIN_POPULATION, self.MIN_CITY_LENGTH)[0][0]
+                countries[city] = alternative2name[country]
+        # States and countries before cities of the same name
+        for (states, country) in [(self.USAStates, 'usa'), (self.CanadaProvinces, 'canada'),
+                                  (self.BrazilStates, 'brazil')]:
+            for name in states.namesSet:
+                if len(name) >= self.MIN_FUZZY_LENGTH:
+                    countries[name] = alternative2name[country]
+        for name in self.WorldCountries.namesSet:
+            if len(name) >= self.MIN_FUZZY_LENGTH:
+                countries[name] = alternative2name[name]
+        return countries, FuzzyIndex(countries.iterkeys(), self.FUZZY_DISTANCE)
         
+    
     '''Look for country names inside the string.'''
-    def __searchCountry(self, location_norm):
-        # Exclude names of US states (Georgia) or Canadian provinces
-        clear_countries = self.WorldCountries.namesSet#.difference(self.USAStates.namesSet.union(self.CanadaProvinces.namesSet))
-        
-        # Do not split multi-word country names if they appear as substrings
-        multiwords = self.__multiWords(clear_countries)
-        parts = self.__partsWithoutSplitting(location_norm, multiwords)
-                
-        # Look for occurrences of country names in the list of parts
-#        candidates = set([self.WorldCountries.alternative2name[c] for c in clear_countries if c in parts and len(c)>=self.MIN_COUNTRY_LENGTH])
-        return set([self.WorldCountries.alternative2name[c] for c in clear_countries if c in parts])
+    def __searchCountry(self, analysis):
+        # Multi-word country names are not split if they appear as substrings
+        found = self.countryIndex.search(analysis.text, analysis.parts)
+        if not self.overlay.empty:
+            return self.overlay.countryNames(found, analysis.text, analysis.parts)
+        return set([self.WorldCountries.alternative2name[c] for c in found])
         
         
     '''Search for names of states for a given country (USA, Canada, Brazil)'''
-    def __searchState(self, location_norm, namesSet):
-        multiwords = self.__multiWords(namesSet)
-        parts = self.__partsWithoutSplitting(location_norm, multiwords)
-        return set(parts).intersection(namesSet)
+    def __searchState(self, analysis, statesIndex):
+        return statesIndex.search(analysis.text, analysis.parts)
     
         
     '''Search for 2-letter state abbreviations for a given country (USA, Canada, Brazil)'''
-    def __searchStateAbbrevEnd(self, location_norm, abbrevsSet):
+    def __searchStateAbbrevEnd(self, analysis, abbrevsSet):
         intersect = set()
         
-        # Compute comma parts
-        comma_parts = self.__commaParts(location_norm)
+        comma_parts = analysis.commaParts
         if len(comma_parts) > 1:
-            intersect.update( set(comma_parts).intersection(abbrevsSet) )
+            intersect.update( abbrevsSet.intersection(comma_parts) )
             
             # Last comma part might be of the form:
             # 773 white road, bowdoinham, me 04008
-            last = comma_parts[-1]
-            # Get trailing number, check if post-code-like
-            number = self.__get_trailing_number(last)
+            # Check if the trailing number is post-code-like
+            number = analysis.trailingNumber
             if number is not None and len(number)==5:
                 # Look for USA state abbrev
-                parts = self.__parts(last)
-                intersect.update( set(parts).intersection(abbrevsSet) )
+                intersect.update( abbrevsSet.intersection(analysis.lastCommaTokens) )
         
         # If there are no commas to split on, check last space part
         elif len(comma_parts) == 1:
-            parts = self.__parts(location_norm)
-            if len(parts):
-                intersect.update( set([parts[-1]]).intersection(abbrevsSet))
+            if analysis.lastToken in abbrevsSet:
+                intersect.add(analysis.lastToken)
         
         return intersect
 
 
     '''Search for names of big cities (>=MIN_POPULATION). If multiple, keep only the largest.'''
-    def __searchLargeCity(self, location_norm):
+    def __searchLargeCity(self, analysis):
         candidate_countries = set()
-        # Compute parts
-        parts = [p for p in self.__parts(location_norm) if len(p)>=self.MIN_CITY_LENGTH]
+        parts = [p for p in analysis.parts if len(p)>=self.MIN_CITY_LENGTH]
         if len(parts):
-            # Store the location string as a suffix tree 
-            std = SuffixTree.SubstringDict()
-            std[location_norm] = True
-            
-            # Look for candidate cities among the parts
-            candidates = set()
-            for p in parts:
-                suffixes = self.stdWorldCitiesLarge[p]
-                for suf in suffixes:
-                    if len(std[suf]):
-                        candidates.add(suf)
-                        
-            # Remove substrings from the list of candidates
-            # ['paris', 'saint-marc', 'saint-marcel']
-            # ['paris', 'saint-marcel']
-            pruned = removeSubstrings(candidates)
+            # Look for cities containing one of the parts, in a single pass
+            # over the location string. Substrings of other candidates are
+            # removed: ['paris', 'saint-marc', 'saint-marcel']
+            # becomes ['paris', 'saint-marcel']
+            pruned = self.cityMatcher.search(analysis.text, parts, self.MIN_POPULATION, self.MIN_CITY_LENGTH, self.overlay)
             
             for city in pruned:
-                most_likely_country = sorted(self.WorldCities.largeCity2countryPopulation[city], key=lambda e:-e[1])[0]
-                candidate_countries.add(self.WorldCountries.alternative2name[most_likely_country[0]])
+                most_likely_country = self.__postings(city, self.MIN_POPULATION, self.MIN_CITY_LENGTH)[0][0]
+                candidate_countries.add(self.WorldCountries.alternative2name[most_likely_country])
 #                for (c,_) in self.WorldCities.largeCity2countryPopulation[city]:
 #                    candidate_countries.add(self.WorldCountries.alternative2name[c])
                     
@@ -215,117 +393,287 @@ class CountryGuesser:
             
     
     '''Search for names of any cities. Keep all results.'''
-    def __searchAnyCity(self, location_norm):
+    def __searchAnyCity(self, analysis):
         candidate_countries = set()
-        # Compute parts
-        parts = [p for p in self.__parts(location_norm) if len(p)>=self.MIN_CITY_LENGTH]
+        parts = [p for p in analysis.parts if len(p)>=self.MIN_CITY_LENGTH]
         if len(parts):
-            # Store the location string as a suffix tree 
-            std = SuffixTree.SubstringDict()
-            std[location_norm] = True
-            
-            # Look for candidate cities among the parts
-            candidates = set()
-            for p in parts:
-                suffixes = self.stdWorldCitiesAll[p]
-                for suf in suffixes:
-                    if len(std[suf]):
-                        candidates.add(suf)
-                        
-            # Remove substrings from the list of candidates
-            # ['paris', 'saint-marc', 'saint-marcel']
-            # ['paris', 'saint-marcel']
-            pruned = removeSubstrings(candidates)
+            # Look for cities containing one of the parts, in a single pass
+            # over the location string. Substrings of other candidates are
+            # removed: ['paris', 'saint-marc', 'saint-marcel']
+            # becomes ['paris', 'saint-marcel']
+            pruned = self.cityMatcher.search(analysis.text, parts, 0, self.MIN_CITY_LENGTH, self.overlay)
             
+            usa = self.WorldCountries.alternative2name['usa']
             for city in pruned:
                 where_is = set()
-                for (c,_) in self.WorldCities.city2countryPopulation[city]:
+                for (c,_) in self.__postings(city, 0, self.MIN_CITY_LENGTH):
                     where_is.add(self.WorldCountries.alternative2name[c])
             
-                if self.WorldCountries.alternative2name['usa'] in where_is:
+                if usa in where_is:
                     # Check if last part is an abbreviation of a US state
-                    all_parts = self.__parts(location_norm)
-                    if all_parts[-1] in self.USAStates.abbrevsSet:
-                        where_is = [self.WorldCountries.alternative2name['usa']]
+                    if analysis.lastToken in self.USAStates.abbrevsSet:
+                        where_is = [usa]
                 candidate_countries.update(where_is)
                     
         return candidate_countries
         
         
+    '''The (country, population) pairs of a city, largest first.'''
+    def __postings(self, city, min_population, min_length):
+        if self.overlay.empty:
+            return self.WorldCities.postings(city, min_population, min_length)
+        return self.overlay.postings(city, self.WorldCities, min_population, min_length)
+    
+    
     '''Search for post codes for different countries.'''
-    def __searchPostCode(self, location_norm):
-        candidates = set()
-        for tld, rex in self.PostCodes.regex.iteritems():
-            m = rex.search(location_norm)
-            if m is not None:
-                candidates.add(self.WorldCountries.tld2name[tld])
-        return candidates
+    def __searchPostCode(self, analysis):
+        return set([self.WorldCountries.tld2name[tld] for tld in self.PostCodes.search(analysis.text)])
+    
+    
+    '''Search for names one typo away from the tokens that are no known
+    name (or blacklisted term) themselves.'''
+    def __searchFuzzy(self, analysis):
+        candidate_countries = set()
+        for token in analysis.parts:
+            if len(token) < self.MIN_FUZZY_LENGTH \
+                    or token in self.fuzzyCountries \
+                    or token in self.blackList \
+                    or self.WorldCities.nameId(token) is not None:
+                continue
+            for name in self.fuzzyIndex.search(token):
+                candidate_countries.add(self.fuzzyCountries[name])
+        return candidate_countries
     
     
         
-    def apply_rules(self, location_norm):
-        candidates = set()
-        
-        # Look for occurences of country names
-        found_countries = self.__searchCountry(location_norm)
-        if len(found_countries):
-            candidates.update([(c, self.R_COUNTRY) for c in sorted(found_countries)])
-
-        # Look for state names (USA, Canada, Brazil)
+    '''Look for occurences of country names'''
+    def __ruleCountry(self, analysis):
+        return [(c, self.R_COUNTRY) for c in sorted(self.__searchCountry(analysis))]
+    
+    
+    '''Look for state names (USA, Canada, Brazil)'''
+    def __ruleState(self, analysis):
+        found = []
         # USA
-        states = self.USAStates.namesSet
-        if len(self.__searchState(location_norm, states)):
-            candidates.add((self.WorldCountries.alternative2name['usa'], self.R_STATE))
+        if len(self.__searchState(analysis, self.usaStatesIndex)):
+            found.append((self.WorldCountries.alternative2name['usa'], self.R_STATE))
         # Canada
-        states = self.CanadaProvinces.namesSet
-        if len(self.__searchState(location_norm, states)):
-            candidates.add((self.WorldCountries.alternative2name['canada'], self.R_STATE))
+        if len(self.__searchState(analysis, self.canadaProvincesIndex)):
+            found.append((self.WorldCountries.alternative2name['canada'], self.R_STATE))
         # Brazil
-        states = self.BrazilStates.namesSet
-        if len(self.__searchState(location_norm, states)):
-            candidates.add((self.WorldCountries.alternative2name['brazil'], self.R_STATE))
-
-        # Look for 2-letter state/country codes at the end of the string
+        if len(self.__searchState(analysis, self.brazilStatesIndex)):
+            found.append((self.WorldCountries.alternative2name['brazil'], self.R_STATE))
+        return found
+    
+    
+    '''Look for 2-letter state codes at the end of the string'''
+    def __ruleStateAbbrev(self, analysis):
+        found = []
         # USA
         abbrevs = self.USAStates.abbrevsSet
-        if len(self.__searchStateAbbrevEnd(location_norm, abbrevs)):
-            candidates.add((self.WorldCountries.alternative2name['usa'], self.R_STATE_ABBREV))
+        if len(self.__searchStateAbbrevEnd(analysis, abbrevs)):
+            found.append((self.WorldCountries.alternative2name['usa'], self.R_STATE_ABBREV))
         # Canada
         abbrevs = self.CanadaProvinces.abbrevsSet
-        if len(self.__searchStateAbbrevEnd(location_norm, abbrevs)):
-            candidates.add((self.WorldCountries.alternative2name['canada'], self.R_STATE_ABBREV))
+        if len(self.__searchStateAbbrevEnd(analysis, abbrevs)):
+            found.append((self.WorldCountries.alternative2name['canada'], self.R_STATE_ABBREV))
         # Brazil
         abbrevs = self.BrazilStates.abbrevsSet
-        if len(self.__searchStateAbbrevEnd(location_norm, abbrevs)):
-            candidates.add((self.WorldCountries.alternative2name['brazil'], self.R_STATE_ABBREV))
-        # Any country TLD
-        abbrevs = self.WorldCountries.tldsSet
-        matches = self.__searchStateAbbrevEnd(location_norm, abbrevs)
-        candidates.update([(self.WorldCountries.tld2name[c], self.R_TLD) for c in matches])
-        
-        # Look for large cities
-        found_countries = self.__searchLargeCity(location_norm)
-        if len(found_countries):
-            candidates.update([(c, self.R_BIG_CITY) for c in sorted(found_countries)])
-        
-        # Look for other cities
-        found_countries = self.__searchAnyCity(location_norm)
-        if len(found_countries):
-            candidates.update([(c, self.R_ANY_CITY) for c in sorted(found_countries)])
-        
-        # Look for post codes
-        found_countries = self.__searchPostCode(location_norm)
-        if len(found_countries):
-            candidates.update([(c, self.R_POST_CODE) for c in sorted(found_countries)])
-        
+        if len(self.__searchStateAbbrevEnd(analysis, abbrevs)):
+            found.append((self.WorldCountries.alternative2name['brazil'], self.R_STATE_ABBREV))
+        return found
+    
+    
+    '''Look for 2-letter country codes (any country TLD) at the end of the string'''
+    def __ruleTLD(self, analysis):
+        matches = self.__searchStateAbbrevEnd(analysis, self.WorldCountries.tldsSet)
+        return [(self.WorldCountries.tld2name[c], self.R_TLD) for c in matches]
+    
+    
+    '''Look for large cities'''
+    def __ruleBigCity(self, analysis):
+        return [(c, self.R_BIG_CITY) for c in sorted(self.__searchLargeCity(analysis))]
+    
+    
+    '''Look for other cities'''
+    def __ruleAnyCity(self, analysis):
+        return [(c, self.R_ANY_CITY) for c in sorted(self.__searchAnyCity(analysis))]
+    
+    
+    '''Look for post codes'''
+    def __rulePostCode(self, analysis):
+        return [(c, self.R_POST_CODE) for c in sorted(self.__searchPostCode(analysis))]
+    
+    
+    '''Look for names with typos'''
+    def __ruleFuzzy(self, analysis):
+        return [(c, self.R_FUZZY) for c in sorted(self.__searchFuzzy(analysis))]
+    
+    
+    def __initRules(self):
+        # The rules, cheapest first. The city rules are the expensive ones;
+        # in lazy mode they only run when they can still change the answer.
+        self.cheapRules = [
+            (self.R_TLD, self.__ruleTLD),
+            (self.R_POST_CODE, self.__rulePostCode),
+            (self.R_STATE_ABBREV, self.__ruleStateAbbrev),
+            (self.R_COUNTRY, self.__ruleCountry),
+            (self.R_STATE, self.__ruleState),
+        ]
+        self.cityRules = [
+            (self.R_BIG_CITY, self.__ruleBigCity),
+            (self.R_ANY_CITY, self.__ruleAnyCity),
+        ]
+        # Only counts without exact clues (see DecisionTable), so in lazy
+        # mode it only runs when the other rules found nothing
+        self.fuzzyRules = [
+            (self.R_FUZZY, self.__ruleFuzzy),
+        ]
+    
+    
+    def __runRules(self, rules, analysis, candidates):
+        stats = self.stats
+        for (rule, function) in rules:
+            if stats is None:
+                candidates.update(function(analysis))
+            else:
+                start = timer()
+                found = function(analysis)
+                stats.record(rule, timer() - start, len(found) > 0)
+                candidates.update(found)
+    
+    
+    '''True if the city rules cannot change the answer any more, given the
+    candidates of all other rules. Together the city rules add at most one
+    to the count of any country, since (c,ANY_CITY) is dropped when there
+    is (c,BIG_CITY). So the answer is fixed if one country leads all others
+    by at least two and has at least two clues (majority vote), or if
+    there is a single country and it was named explicitly (country rule).'''
+    def __decided(self, candidates):
+        return self.decisionTable.decided(candidates)
+    
+    
+    '''Return the set of (country, rule) candidates for location_norm. With
+    lazy=True the city rules (and the fuzzy rule) are skipped when they
+    cannot change the answer of guess; the candidates are then incomplete, but guess
+    returns the same countries.'''
+    def apply_rules(self, location_norm, lazy=False):
+        # All rules read the same analysis of the string
+        analysis = LocationAnalysis(location_norm)
+        candidates = set()
+        self.__runRules(self.cheapRules, analysis, candidates)
+        if not lazy or not self.__decided(candidates):
+            self.__runRules(self.cityRules, analysis, candidates)
+        if self.fuzzyIndex is not None and (not lazy or not len(candidates)):
+            self.__runRules(self.fuzzyRules, analysis, candidates)
         return candidates
     
     
+    '''Transliterate / remove diacritics / convert to lower case.'''
+    def normalize(self, location):
+        return normalization.normalize(location)
+    
+    
     def guess(self, location):
-        # Transliterate / remove diacritics / convert to lower case
-        location_norm = unidecode(location).lower().strip()
-
-        candidates = self.apply_rules(location_norm)
+        return self.guess_normalized(self.normalize(location))
+    
+    
+    '''Same as guess, for a location that is already normalised.'''
+    def guess_normalized(self, location_norm):
+        self.__checkOverlay()
+        countries = None
+        if self.cache is not None:
+            countries = self.cache.get(location_norm)
+        if countries is None and self.resultCache is not None:
+            countries = self.resultCache.get(self.fingerprint(), location_norm)
+        if countries is None:
+            countries = self.__guess(location_norm)
+        if self.cache is not None:
+            self.cache.put(location_norm, countries)
+        # Callers may modify the list they get
+        return list(countries)
+    
+    
+    def __checkOverlay(self):
+        if self.overlay.version != self.__overlayVersion:
+            # Answers cached before the overlay changed may be wrong now
+            self.clear_cache()
+            self.__overlayVersion = self.overlay.version
+    
+    
+    '''The countries for a normalised location, with the reasons behind
+    them: (countries, rules, decision), where rules are the (country, rule
+    label) candidates, sorted, and decision the label of the decision
+    branch. No cache is used.'''
+    def explain_normalized(self, location_norm):
+        countries, candidates, decision = self.__resolve(location_norm)
+        return countries, self.__ruleLabels(candidates), self.decision_labels[decision]
+    
+    
+    def __ruleLabels(self, candidates):
+        return sorted([(c, self.rule_labels[r]) for (c, r) in candidates])
+    
+    
+    '''Fingerprint of everything the answers depend on: the data files, the
+    thresholds and options of the rules, and the overlay. Answers in the
+    result cache are stored under it.'''
+    def fingerprint(self):
+        params = [RESULT_CACHE_VERSION, self.MIN_POPULATION, self.MIN_CITY_LENGTH,
+                  self.MIN_COUNTRY_LENGTH, self.fuzzyIndex is not None,
+                  self.MIN_FUZZY_LENGTH, self.FUZZY_DISTANCE]
+        if self.scope is not None:
+            params.append(self.scope.key)
+        key = (tuple(params), id(self.overlay), self.overlay.version)
+        if self.__fingerprint[0] != key:
+            if self.__dataChecksum is None:
+                self.__dataChecksum = indexSnapshot.checksum((), self.citySource)
+            md5 = hashlib.md5()
+            md5.update('%s;%r' % (self.__dataChecksum, params))
+            if not self.overlay.empty:
+                md5.update(json.dumps(self.overlay.delta(), sort_keys=True))
+            self.__fingerprint = (key, md5.hexdigest())
+        return self.__fingerprint[1]
+    
+    
+    def clear_cache(self):
+        if self.cache is not None:
+            self.cache.clear()
+    
+    
+    def __guess(self, location_norm):
+        countries, candidates, decision = self.__resolve(location_norm)
+        if self.resultCache is not None:
+            self.resultCache.put(self.fingerprint(), location_norm, countries,
+                                 self.__ruleLabels(candidates), self.decision_labels[decision])
+        return countries
+    
+    
+    def __resolve(self, location_norm):
+        candidates = self.apply_rules(location_norm, self.lazy)
+        countries, decision = self.__decide(candidates)
+        if self.scope is not None:
+            countries = self.scope.restrict(countries)
+        if self.stats is not None:
+            self.stats.decided(decision)
+        if self.on_decision is not None:
+            self.on_decision(location_norm, candidates, countries, decision)
+        return countries, candidates, decision
+    
+    
+    '''Pick the countries from the (country, rule) candidates. Returns the
+    countries and the decision branch that produced them.'''
+    def __decide(self, candidates):
+        return self.decisionTable.decide(candidates)
+    
+    
+    '''The decision logic of __decide, as a cascade over the candidates
+    (which it modifies). Kept as the reference the decision table is
+    checked against (see benchmark).'''
+    def __decideCascade(self, candidates):
+        # Fuzzy matches only count without exact clues
+        fuzzy = [(c,r) for (c,r) in candidates if r == self.R_FUZZY]
+        if len(fuzzy) and len(fuzzy) < len(candidates):
+            candidates.difference_update(fuzzy)
         
         if len(candidates):
             # Remove (c,ANY_CITY) if also (c,BIG_CITY)
@@ -335,15 +683,14 @@ class CountryGuesser:
             # Count the distinct countries. Only one country = easy guess
             distinct_countries = set([c for (c,_) in candidates])
             if len(distinct_countries) == 1:
-                return sorted(distinct_countries)
+                return sorted(distinct_countries), self.D_SINGLE
             
             # Simple majority vote: if multiple clues point to the same country, that's the country
-            results = [(c,self.rule_labels[r]) for (c,r) in candidates]
-            counter = Counter([elem[0] for elem in results])
+            counter = Counter([c for (c,_) in candidates])
             max_count = max(counter.items(), key=lambda elem:elem[1])[1]
             if max_count > 1:
                 countries = [c for c,v in counter.items() if v==max_count]
-                return sorted(countries)
+                return sorted(countries), self.D_MAJORITY
 
             # Big city > any city
             na = len(set([c for (c,r) in candidates 
@@ -353,13 +700,13 @@ class CountryGuesser:
                 countries = set([c for (c,_) in candidates 
                              if (c,self.R_BIG_CITY) in candidates])
                 if len(countries):
-                    return sorted(countries)
+                    return sorted(countries), self.D_BIG_CITY
             
             # Country > anything else
             countries = set([c for (c,_) in candidates 
                          if (c,self.R_COUNTRY) in candidates])
             if len(countries):
-                return list(countries)
+                return list(countries), self.D_COUNTRY
             
             # State_abbrev & TLD => State_abbrev
             na = len(set([c for (c,r) in candidates 
@@ -369,7 +716,7 @@ class CountryGuesser:
                 countries = set([c for (c,_) in candidates 
                              if (c,self.R_STATE_ABBREV) in candidates])
                 if len(countries) == 1:
-                    return sorted(countries)
+                    return sorted(countries), self.D_STATE_ABBREV
 
             # State > any_city
             na = len(set([c for (c,r) in candidates 
@@ -379,11 +726,118 @@ class CountryGuesser:
                 countries = set([c for (c,_) in candidates 
                              if (c,self.R_STATE) in candidates])
                 if len(countries) == 1:
-                    return sorted(countries)
+                    return sorted(countries), self.D_STATE
             
-            print location_norm, '--', results, '--', counter
+            return [None], self.D_UNRESOLVED
             
-        return [None]
+        return [None], self.D_NONE
+        
+        
+    '''An on_decision callback printing the cases that could not be
+    resolved despite candidates, for use while tuning the rules.'''
+    def report_unresolved(self, location_norm, candidates, countries, decision):
+        if decision == self.D_UNRESOLVED:
+            results = [(c,self.rule_labels[r]) for (c,r) in candidates]
+            print location_norm, '--', results, '--', Counter([c for (c,_) in candidates])
+        
+        
+    '''Create a pool of worker processes that inherit this guesser through
+    fork, for use with guess_many. The caller closes the pool. The pool
+    only serves this guesser: other guessers refuse it.'''
+    def make_pool(self, workers=None):
+        # The initializer, not a global of this process: workers forked
+        # later (to replace dead ones) must get this guesser too
+        pool = multiprocessing.Pool(workers, _initWorker, (self,))
+        pool.guesser = self
+        return pool
+    
+    
+    '''Guess the countries for many locations, using a pool of worker
+    processes. Results are returned in input order. Identical locations
+    (after normalisation) are only resolved once. workers=1 (default) runs
+    in this process; workers=None forks a pool of all cores for the call.
+    A pool of this guesser (see make_pool) can be passed instead, to avoid
+    forking for every call. With a result cache, the locations are looked
+    up there in batches, and the answers of the others written there at
+    once.'''
+    def guess_many(self, locations, workers=1, chunksize=100, pool=None):
+        locations_norm = [self.normalize(location) for location in locations]
+        unique = list(OrderedDict.fromkeys(locations_norm))
+        
+        if self.resultCache is None:
+            answers = self.__map(_guessInWorker, self.guess_normalized, unique, workers, chunksize, pool)
+            answers = dict(zip(unique, answers))
+        else:
+            self.__checkOverlay()
+            fingerprint = self.fingerprint()
+            answers = self.resultCache.getMany(fingerprint, unique)
+            missing = [location_norm for location_norm in unique if location_norm not in answers]
+            explained = self.__map(_explainInWorker, self.explain_normalized, missing, workers, chunksize, pool)
+            self.resultCache.putMany(fingerprint, [(location_norm, countries, rules, decision)
+                                                   for (location_norm, (countries, rules, decision))
+                                                   in zip(missing, explained)])
+            for (location_norm, (countries, _, _)) in zip(missing, explained):
+                answers[location_norm] = countries
+        return [list(answers[location_norm]) for location_norm in locations_norm]
+    
+    
+    '''explain_normalized for many normalised locations, in input order,
+    resolving each distinct one once (in a pool of workers, as in
+    guess_many). With a result cache, the explanations are read from it
+    in batches, and those of the others written there at once.'''
+    def explain_many(self, locations_norm, workers=1, chunksize=100, pool=None):
+        unique = list(OrderedDict.fromkeys(locations_norm))
+        self.__checkOverlay()
+        explanations = {}
+        if self.resultCache is not None:
+            fingerprint = self.fingerprint()
+            explanations = self.resultCache.explainMany(fingerprint, unique)
+        missing = [location_norm for location_norm in unique if location_norm not in explanations]
+        explained = self.__map(_explainInWorker, self.explain_normalized, missing, workers, chunksize, pool)
+        if self.resultCache is not None:
+            self.resultCache.putMany(fingerprint, [(location_norm, countries, rules, decision)
+                                                   for (location_norm, (countries, rules, decision))
+                                                   in zip(missing, explained)])
+        explanations.update(zip(missing, explained))
+        return [explanations[location_norm] for location_norm in locations_norm]
+    
+    
+    '''Guess the countries for a pandas column (or any sequence) of
+    locations, resolving each distinct location once. Returns a DataFrame
+    with the index of the column and categorical columns; see
+    columnGuesser. Needs pandas.'''
+    def guess_column(self, column, workers=1, chunksize=100, pool=None):
+        # Imported here: pandas is optional, and slow to import
+        import columnGuesser
+        return columnGuesser.guess_column(self, column, workers, chunksize, pool)
+    
+    
+    '''Apply function to the items in a pool of workers (worker, a module
+    function using _poolGuesser), or here (local), as in guess_many.'''
+    def __map(self, worker, local, items, workers, chunksize, pool):
+        if not len(items):
+            # E.g., all answers were in the result cache
+            return []
+        if pool is not None:
+            if getattr(pool, 'guesser', None) is not self:
+                # Its workers would answer with the data and parameters of
+                # another guesser
+                raise ValueError('pool not made by this guesser (see make_pool)')
+            return pool.map(worker, items, chunksize)
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        if workers <= 1:
+            return [local(item) for item in items]
+        pool = self.make_pool(workers)
+        try:
+            results = pool.map(worker, items, chunksize)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        return results
         
         
         
@@ -396,16 +850,15 @@ if __name__=="__main__":
     writer = UnicodeWriter(g)
     
     cg = CountryGuesser()
+    cg.on_decision = cg.report_unresolved
     
     succ = 0
     fail = 0
     
     f = open(os.path.join(os.path.abspath('.'), 'data', 'sample.csv'), 'rb')
     reader = UnicodeReader(f)
-    for row in reader:
-        location = row[0]
-        location_norm = unidecode(location).lower().strip()
-        country = cg.guess(location)
+    locations = [row[0] for row in reader]
+    for location, country in zip(locations, cg.guess_many(locations)):
         if country[0] is None:
             fail += 1
         else:
@@ -0,0 +1,119 @@
+# This Python file uses the following encoding: utf-8
+
+"""Copyright 2014 Bogdan Vasilescu
+Eindhoven University of Technology
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+# Process-wide registry of the datasets. Each one is built on first use,
+# exactly once, and the same instance is handed to everything that needs
+# it (several guessers, WorldCities, ...):
+#
+#   countries = dataRegistry.get('WorldCountries')
+#
+# The datasets are read-only once built, so sharing them is safe. Those
+# of SCOPED_LOADERS also exist per RegionScope, restricted to its
+# countries, and per GeoNames dump (a CitySource; data/cities1000.csv by
+# default):
+#
+#   cities = dataRegistry.get('WorldCities', scope)
+#   cities = dataRegistry.get('WorldCities', source=CitySource('allCountries.txt', workers=8))
+
+import threading
+
+from usaStates import USAStates
+from brazilStates import BrazilStates
+from canadaProvinces import CanadaProvinces
+from worldCountries import WorldCountries
+from worldCities import WorldCities
+from blackList import BlackList
+from postCodes import PostCodes
+from cityMatcher import CityMatcher
+from cityIndexBuilder import CitySource
+
+
+# How to build each dataset; dependencies come from the registry as well
+LOADERS = {
+    'USAStates': USAStates,
+    'BrazilStates': BrazilStates,
+    'CanadaProvinces': CanadaProvinces,
+    'WorldCountries': WorldCountries,
+    'BlackList': BlackList,
+    'PostCodes': PostCodes,
+    'WorldCities': lambda: WorldCities(countries=get('WorldCountries'), blackList=get('BlackList')),
+    'CityMatcher': lambda: CityMatcher(get('WorldCities')),
+}
+
+# How to build the datasets restricted to a scope, or read from another
+# dump; the others are the same for any scope and dump
+SCOPED_LOADERS = {
+    'WorldCities': lambda scope, source: WorldCities(countries=get('WorldCountries'), blackList=get('BlackList'),
+                                                     path=source.path, delimiter=source.delimiter,
+                                                     workers=source.workers, chunk_lines=source.chunk_lines,
+                                                     scope=scope),
+    'CityMatcher': lambda scope, source: CityMatcher(get('WorldCities', scope, source)),
+}
+
+_instances = {}
+# Reentrant: building WorldCities gets WorldCountries while holding it
+_lock = threading.RLock()
+
+
+def _key(name, scope, source):
+    if source is not None and source.isDefault():
+        source = None
+    if (scope is None and source is None) or name not in SCOPED_LOADERS:
+        return name
+    return (name, scope.key if scope is not None else None, source.path if source is not None else None)
+
+
+'''The instance of the named dataset, built on first use, restricted to
+scope (a RegionScope) and read from source (a CitySource) if given.'''
+def get(name, scope=None, source=None):
+    key = _key(name, scope, source)
+    try:
+        return _instances[key]
+    except KeyError:
+        pass
+    with _lock:
+        if key not in _instances:
+            if key == name:
+                _instances[key] = LOADERS[name]()
+            else:
+                _instances[key] = SCOPED_LOADERS[name](scope, source or CitySource())
+        return _instances[key]
+
+
+'''Register instance (e.g., loaded from a snapshot) for name, unless the
+dataset was already there. Returns the registered instance.'''
+def provide(name, instance, scope=None, source=None):
+    with _lock:
+        return _instances.setdefault(_key(name, scope, source), instance)
+
+
+def isLoaded(name, scope=None, source=None):
+    return _key(name, scope, source) in _instances
+
+
+'''Forget all instances, e.g., after the data files changed. Objects
+already holding them keep their copies.'''
+def clear():
+    with _lock:
+        _instances.clear()
+
+
+if __name__=="__main__":
+    for name in sorted(LOADERS):
+        get(name)
+        print name, 'loaded'
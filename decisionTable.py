@@ -0,0 +1,142 @@
+# This Python file uses the following encoding: utf-8
+
+"""Copyright 2014 Bogdan Vasilescu
+Eindhoven University of Technology
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+# The decision step of CountryGuesser.guess, compiled into tables. The
+# candidates of each country are summarised as a bitmask of the rules
+# that fired for it (bit 1 << rule). Everything the cascade of guess looks
+# at follows from these masks:
+#  - effective[mask]: the mask without ANY_CITY if it has BIG_CITY
+#  - counts[mask]: the number of clues left, i.e., the votes of the country
+#  - branches[union]: what decides between countries with a single vote
+#    each, given the union of their (effective) masks
+# so deciding is one pass over the countries, plus table lookups.
+# Fuzzy matches (typos) are a fallback: they are dropped, with the
+# countries only they point to, as soon as any rule found an exact clue.
+
+
+class DecisionTable:
+    '''Decides like the cascade of CountryGuesser, from per-country masks
+    of rules. cg provides the rule (R_) and decision (D_) constants and
+    rule_labels, which lists all the rules.'''
+
+    def __init__(self, cg):
+        self.cg = cg
+        size = 1 << (max(cg.rule_labels) + 1)
+
+        self.bits = [1 << rule for rule in range(max(cg.rule_labels) + 1)]
+        bigCity = 1 << cg.R_BIG_CITY
+        anyCity = 1 << cg.R_ANY_CITY
+        self.fuzzy = 1 << cg.R_FUZZY
+
+        # (c,ANY_CITY) is dropped if there is (c,BIG_CITY)
+        self.effective = [mask & ~anyCity if mask & bigCity else mask for mask in range(size)]
+        self.counts = [bin(mask).count('1') for mask in self.effective]
+        self.branches = [self.__branch(union) for union in range(size)]
+
+
+    '''The branch deciding between countries with one (effective) clue each,
+    whose masks together are union: (decision, rule selecting the
+    countries, whether exactly one country must be selected, whether the
+    answer is sorted). rule is None if the countries stay unresolved.'''
+    def __branch(self, union):
+        cg = self.cg
+        bit = lambda rule: 1 << rule
+        only = lambda *rules: not union & ~sum([bit(r) for r in rules])
+
+        # Big city > any city
+        if only(cg.R_BIG_CITY, cg.R_ANY_CITY) and union & bit(cg.R_BIG_CITY):
+            return (cg.D_BIG_CITY, cg.R_BIG_CITY, False, True)
+        # Country > anything else (in no particular order, as it has always been)
+        if union & bit(cg.R_COUNTRY):
+            return (cg.D_COUNTRY, cg.R_COUNTRY, False, False)
+        # State_abbrev & TLD => State_abbrev
+        if only(cg.R_STATE_ABBREV, cg.R_TLD) and union & bit(cg.R_STATE_ABBREV):
+            return (cg.D_STATE_ABBREV, cg.R_STATE_ABBREV, True, True)
+        # State > any_city
+        if only(cg.R_STATE, cg.R_ANY_CITY) and union & bit(cg.R_STATE):
+            return (cg.D_STATE, cg.R_STATE, True, True)
+        return (cg.D_UNRESOLVED, None, False, False)
+
+
+    '''country -> mask of the rules among the (country, rule) candidates.'''
+    def masks(self, candidates):
+        bits = self.bits
+        masks = {}
+        for (c, r) in candidates:
+            masks[c] = masks.get(c, 0) | bits[r]
+        return masks
+
+
+    '''Pick the countries from the (country, rule) candidates, as the
+    cascade does. Returns the countries and the decision branch.'''
+    def decide(self, candidates):
+        cg = self.cg
+        masks = self.masks(candidates)
+        if not len(masks):
+            return [None], cg.D_NONE
+        fuzzy = self.fuzzy
+        union = 0
+        for mask in masks.itervalues():
+            union |= mask
+        if union & fuzzy and union & ~fuzzy:
+            masks = dict([(c, mask & ~fuzzy) for (c, mask) in masks.iteritems() if mask & ~fuzzy])
+        # Only one country = easy guess
+        if len(masks) == 1:
+            return masks.keys(), cg.D_SINGLE
+
+        effective = self.effective
+        counts = self.counts
+        union = 0
+        best = 0
+        for mask in masks.itervalues():
+            union |= effective[mask]
+            if counts[mask] > best:
+                best = counts[mask]
+
+        # Simple majority vote
+        if best > 1:
+            return sorted([c for (c, mask) in masks.iteritems() if counts[mask] == best]), cg.D_MAJORITY
+
+        (decision, rule, single, ordered) = self.branches[union]
+        if rule is not None:
+            # Each country has one clue: the candidates of rule are the
+            # countries selected, each once
+            countries = [c for (c, r) in candidates if r == rule]
+            if not single or len(countries) == 1:
+                return sorted(countries) if ordered else list(set(countries)), decision
+        return [None], cg.D_UNRESOLVED
+
+
+    '''True if the city rules cannot change the answer any more, given the
+    candidates of all other rules (see CountryGuesser.apply_rules).'''
+    def decided(self, candidates):
+        masks = self.masks(candidates)
+        counts = self.counts
+        if len(masks) == 1:
+            mask = masks.values()[0]
+            return counts[mask] > 1 or bool(mask & self.bits[self.cg.R_COUNTRY])
+        if len(masks) > 1:
+            first = second = 0
+            for mask in masks.itervalues():
+                count = counts[mask]
+                if count > first:
+                    first, second = count, first
+                elif count > second:
+                    second = count
+            return first > 1 and second <= first - 2
+        return False
@@ -0,0 +1,137 @@
+# This Python file uses the following encoding: utf-8
+
+"""Copyright 2014 Bogdan Vasilescu
+Eindhoven University of Technology
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+# Names within a small edit distance of a token ("amsterdm", "californa"),
+# with a symmetric deletion index: every name is stored under each string
+# obtained by deleting up to max_distance of its characters. A token can
+# only be that close to a name if they share one of these strings, so a
+# lookup probes the deletions of the token, and checks the few names
+# found with the actual distance. The cost does not depend on the number
+# of names.
+#
+# With CountryGuesser(fuzzy=True), the names of countries, states and big
+# cities are also matched with one typo in tokens that are no known name,
+# when no rule found an exact clue. The names are those of the index,
+# without the overlay.
+
+import os
+
+'''The strings obtained from word by deleting at most distance characters
+(word included).'''
+def deletions(word, distance):
+    found = set([word])
+    frontier = [word]
+    for _ in range(distance):
+        following = []
+        for w in frontier:
+            for i in range(len(w)):
+                d = w[:i] + w[i+1:]
+                if d not in found:
+                    found.add(d)
+                    following.append(d)
+        frontier = following
+    return found
+
+
+'''Edit distance between a and b, counting insertions, deletions,
+substitutions and transpositions of adjacent characters (optimal string
+alignment). Gives up as soon as it exceeds bound, returning bound + 1.'''
+def distance(a, b, bound):
+    if abs(len(a) - len(b)) > bound:
+        return bound + 1
+    if bound <= 1:
+        return _distanceAtMostOne(a, b)
+    previous2 = None
+    previous = range(len(b) + 1)
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i-1] == b[j-1] else 1
+            current[j] = min(previous[j] + 1, current[j-1] + 1, previous[j-1] + cost)
+            if i > 1 and j > 1 and a[i-1] == b[j-2] and a[i-2] == b[j-1]:
+                current[j] = min(current[j], previous2[j-2] + 1)
+        if min(current) > bound:
+            return bound + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+'''distance(a, b, 1), without the dynamic programming: after the common
+prefix, the rest must be equal up to one edit.'''
+def _distanceAtMostOne(a, b):
+    if a == b:
+        return 0
+    if len(a) < len(b):
+        a, b = b, a
+    i = len(os.path.commonprefix([a, b]))
+    if len(a) > len(b):
+        # One deletion from the longer string
+        return 1 if a[i+1:] == b[i:] else 2
+    if a[i+1:] == b[i+1:]:
+        # Substitution
+        return 1
+    if a[i] == b[i+1] and a[i+1] == b[i] and a[i+2:] == b[i+2:]:
+        # Transposition
+        return 1
+    return 2
+
+
+class FuzzyIndex:
+    '''Finds the names (strings) within max_distance edits of a token.'''
+
+    def __init__(self, names, max_distance=1):
+        self.max_distance = max_distance
+        self.names = sorted(set(names))
+        # Deletion -> id of the name it comes from, or list of ids (rare)
+        self.deletions = {}
+        for (i, name) in enumerate(self.names):
+            for key in deletions(name, max_distance):
+                entry = self.deletions.get(key)
+                if entry is None:
+                    self.deletions[key] = i
+                elif isinstance(entry, list):
+                    entry.append(i)
+                else:
+                    self.deletions[key] = [entry, i]
+
+
+    '''The names within max_distance of token, closest first (and then in
+    alphabetical order). The token itself is included if it is a name.'''
+    def search(self, token):
+        ids = set()
+        for key in deletions(token, self.max_distance):
+            entry = self.deletions.get(key)
+            if entry is None:
+                continue
+            if isinstance(entry, list):
+                ids.update(entry)
+            else:
+                ids.add(entry)
+        found = []
+        for i in ids:
+            name = self.names[i]
+            d = distance(token, name, self.max_distance)
+            if d <= self.max_distance:
+                found.append((d, name))
+        return [name for (_, name) in sorted(found)]
+
+
+if __name__=="__main__":
+    index = FuzzyIndex(['amsterdam', 'california', 'eindhoven', 'rotterdam'])
+    for token in ['amsterdm', 'californa', 'eindhovne', 'roterdam', 'berlin']:
+        print token, index.search(token)
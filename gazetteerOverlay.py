@@ -0,0 +1,251 @@
+# This Python file uses the following encoding: utf-8
+
+"""Copyright 2014 Bogdan Vasilescu
+Eindhoven University of Technology
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+# Curation fixes on top of the loaded (read-only) index, without editing
+# the CSV files and rebuilding:
+#
+#   cg.overlay.addCity('eindhoven airport', 'netherlands', 0)
+#   cg.overlay.addCountryAlternative('holland', 'netherlands')
+#   cg.overlay.addBlackList('university')
+#   cg.overlay.save('data/overlay.json')
+#
+#   cg = CountryGuesser(overlay='data/overlay.json')
+#
+# Changes take effect with the next guess. The entries of the overlay are
+# few, so the names it adds get a small automaton (and NameIndex) of
+# their own, recompiled on the first query after a change.
+# The overlay of a guesser can be changed at any time through cg.overlay;
+# worker processes of make_pool only see the changes made before they
+# were forked.
+
+import os
+import json
+
+from ahoCorasick import AhoCorasick
+from nameIndex import NameIndex
+from normalization import normalize
+
+# Bump whenever the layout of the delta file changes
+OVERLAY_VERSION = 1
+
+# All countries, in hiddenCities
+ALL = None
+
+
+class GazetteerOverlay:
+    '''Cities, country alternatives and blacklist terms added to or removed
+    from the loaded data. countries (WorldCountries) resolves the country
+    names given; it defaults to the shared instance of dataRegistry.
+
+    The blacklist of the CSV files is applied when the index is built, so
+    removeBlackList only lifts terms blacklisted by the overlay itself.'''
+
+    def __init__(self, countries=None):
+        if countries is None:
+            import dataRegistry
+            countries = dataRegistry.get('WorldCountries')
+        self.countries = countries
+
+        # city name -> [(country, population)] added
+        self.cities = {}
+        # city name -> countries whose cities of that name are removed
+        # from the index (ALL for all countries)
+        self.hiddenCities = {}
+        # alternative -> country name, added or overriding the index
+        self.alternatives = {}
+        self.removedAlternatives = set()
+        self.blackList = set()
+
+        # Incremented on every change; guessers compare it to invalidate
+        # their caches
+        self.version = 0
+        self.empty = True
+        self.__compiled = None
+
+
+    def __changed(self):
+        self.version += 1
+        self.empty = not (len(self.cities) or len(self.hiddenCities) or len(self.alternatives)
+                          or len(self.removedAlternatives) or len(self.blackList))
+        self.__compiled = None
+
+
+    '''The country name for a country name or alternative (ValueError if
+    unknown).'''
+    def countryName(self, country):
+        country = normalize(country)
+        if country in self.alternatives:
+            return self.alternatives[country]
+        if country in self.countries.alternative2name and country not in self.removedAlternatives:
+            return self.countries.alternative2name[country]
+        raise ValueError('unknown country: %s' % country)
+
+
+    def addCity(self, city, country, population=0):
+        city = normalize(city)
+        if not len(city):
+            raise ValueError('empty city name')
+        posting = (self.countryName(country), int(population))
+        postings = self.cities.setdefault(city, [])
+        if posting not in postings:
+            postings.append(posting)
+        self.__changed()
+
+
+    '''Remove the cities called city, in country or in all countries.'''
+    def removeCity(self, city, country=None):
+        city = normalize(city)
+        if country is not None:
+            country = self.countryName(country)
+        if city in self.cities:
+            self.cities[city] = [(c, p) for (c, p) in self.cities[city] if country is not None and c != country]
+            if not len(self.cities[city]):
+                del self.cities[city]
+        if country is None:
+            self.hiddenCities[city] = ALL
+        elif self.hiddenCities.get(city, set()) is not ALL:
+            self.hiddenCities.setdefault(city, set()).add(country)
+        self.__changed()
+
+
+    def addCountryAlternative(self, alternative, country):
+        alternative = normalize(alternative)
+        if not len(alternative):
+            raise ValueError('empty alternative')
+        self.alternatives[alternative] = self.countryName(country)
+        self.removedAlternatives.discard(alternative)
+        self.__changed()
+
+
+    def removeCountryAlternative(self, alternative):
+        alternative = normalize(alternative)
+        self.alternatives.pop(alternative, None)
+        self.removedAlternatives.add(alternative)
+        self.__changed()
+
+
+    def addBlackList(self, term):
+        self.blackList.add(normalize(term))
+        self.__changed()
+
+
+    def removeBlackList(self, term):
+        self.blackList.discard(normalize(term))
+        self.__changed()
+
+
+    def __compile(self):
+        if self.__compiled is None:
+            self.__compiled = (AhoCorasick(self.cities.iterkeys()),
+                               NameIndex(set(self.alternatives)))
+        return self.__compiled
+
+
+    '''postings of WorldCities (cities), with the changes of the overlay.'''
+    def postings(self, city, cities, min_population=0, min_length=0):
+        if city in self.blackList:
+            return []
+        hidden = self.hiddenCities.get(city, set())
+        if hidden is ALL:
+            postings = []
+        else:
+            postings = [(c, p) for (c, p) in cities.postings(city, min_population, min_length) if c not in hidden]
+        if city in self.cities and len(city) >= min_length:
+            for (c, p) in self.cities[city]:
+                if p >= min_population and (c, p) not in postings:
+                    postings.append((c, p))
+            # Stable: the index first among equally large cities
+            postings.sort(key=lambda e:-e[1])
+        return postings
+
+
+    '''Apply the overlay to the city names found in the index (a set), and
+    add the names of the overlay occurring in location_norm.'''
+    def filterCities(self, found, location_norm, cities, min_population=0, min_length=0):
+        found = set([city for city in found
+                     if (city not in self.blackList and city not in self.hiddenCities)
+                     or len(self.postings(city, cities, min_population, min_length))])
+        automaton, _ = self.__compile()
+        for city in automaton.findall(location_norm):
+            if len(self.postings(city, cities, min_population, min_length)):
+                found.add(city)
+        return found
+
+
+    '''Apply the overlay to the country names (alternatives) found in the
+    index. Returns the country names.'''
+    def countryNames(self, found, location_norm, tokens=None):
+        countries = set([self.countries.alternative2name[c] for c in found
+                         if c not in self.alternatives and c not in self.removedAlternatives])
+        _, alternativesIndex = self.__compile()
+        countries.update([self.alternatives[c] for c in alternativesIndex.search(location_norm, tokens)])
+        return countries
+
+
+    '''The overlay as a JSON-serialisable dict.'''
+    def delta(self):
+        return {
+            'version':OVERLAY_VERSION,
+            'cities':sorted([[city, c, p] for (city, postings) in self.cities.iteritems() for (c, p) in postings]),
+            'hiddenCities':sorted([[city, None if countries is ALL else sorted(countries)]
+                                   for (city, countries) in self.hiddenCities.iteritems()]),
+            'alternatives':sorted([[a, c] for (a, c) in self.alternatives.iteritems()]),
+            'removedAlternatives':sorted(self.removedAlternatives),
+            'blackList':sorted(self.blackList),
+        }
+
+
+    '''Write the overlay to a (small) JSON delta file.'''
+    def save(self, path):
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        f = open(tmp_path, 'wb')
+        json.dump(self.delta(), f, indent=1, sort_keys=True)
+        f.close()
+        os.rename(tmp_path, path)
+
+
+    '''Apply the changes of a delta file (see save) to this overlay.'''
+    def load(self, path):
+        f = open(path, 'rb')
+        delta = json.load(f)
+        f.close()
+        if delta.get('version') != OVERLAY_VERSION:
+            raise ValueError('unsupported overlay version: %r' % delta.get('version'))
+        # Removals first: they also drop added cities
+        for (city, countries) in delta['hiddenCities']:
+            if countries is None:
+                self.removeCity(city)
+            else:
+                for c in countries:
+                    self.removeCity(city, c)
+        for (city, c, p) in delta['cities']:
+            self.addCity(city, c, p)
+        for (a, c) in delta['alternatives']:
+            self.addCountryAlternative(a, c)
+        for a in delta['removedAlternatives']:
+            self.removeCountryAlternative(a)
+        for term in delta['blackList']:
+            self.addBlackList(term)
+
+
+if __name__=="__main__":
+    overlay = GazetteerOverlay()
+    overlay.addCity('eindhoven airport', 'netherlands', 0)
+    overlay.addCountryAlternative('holland', 'netherlands')
+    overlay.addBlackList('university')
+    print json.dumps(overlay.delta(), indent=1)
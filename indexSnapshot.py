@@ -0,0 +1,146 @@
+# This Python file uses the following encoding: utf-8
+
+"""Copyright 2014 Bogdan Vasilescu
+Eindhoven University of Technology
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+import os
+import sys
+import hashlib
+import cPickle
+import gc
+
+this_dir, this_filename = os.path.split(__file__)
+DATA_PATH = os.path.join(this_dir, 'data')
+
+# Default location of the snapshot
+SNAPSHOT_PATH = os.path.join(DATA_PATH, 'index.snapshot')
+
+# Bump whenever the layout of the pickled structures changes
+SNAPSHOT_VERSION = 6
+
+# The GeoNames dump of the defaults (see cityIndexBuilder.CitySource)
+CITIES_FILE = 'cities1000.csv'
+
+# The data files the snapshot is built from; CITIES_FILE stands for the
+# dump actually used
+SOURCE_FILES = ['countries.csv', CITIES_FILE, 'blackList.csv',
+                'usStates.csv', 'canadaProvinces.csv', 'brazilStates.csv']
+
+# Modules whose classes end up in the snapshot
+LOCAL_MODULES = set(['usaStates', 'brazilStates', 'canadaProvinces',
+                     'worldCountries', 'worldCities', 'blackList',
+                     'cityMatcher', 'ahoCorasick'])
+
+# The local modules are imported either as 'worldCities' (when running from
+# this directory) or as 'countryNameManager.worldCities' (as a package)
+PACKAGE_PREFIX = __name__[:-len('indexSnapshot')] if __name__.endswith('.indexSnapshot') else ''
+
+
+'''Fingerprint of the source data files and of the parameters the index
+was built with. Any change to either makes existing snapshots stale.
+source (a CitySource) is the GeoNames dump the cities were read from;
+None is data/cities1000.csv.'''
+def checksum(params=(), source=None):
+    md5 = hashlib.md5()
+    md5.update('%d;%r' % (SNAPSHOT_VERSION, list(params)))
+    for name in SOURCE_FILES:
+        path = os.path.join(DATA_PATH, name)
+        if name == CITIES_FILE and source is not None:
+            path = source.path
+            name = os.path.basename(path)
+        md5.update(name)
+        if not os.path.exists(path):
+            continue
+        f = open(path, 'rb')
+        block = f.read(1 << 20)
+        while block:
+            md5.update(block)
+            block = f.read(1 << 20)
+        f.close()
+    return md5.hexdigest()
+
+
+'''The path and fingerprint of the prebuilt index (snapshot, or mapped
+index) at path, for the cities kept by scope (a RegionScope), read from
+source (a CitySource); None stands for all cities, and for the default
+dump. Other scopes and dumps get files of their own, next to path.'''
+def locate(path, scope=None, source=None):
+    if source is not None and source.isDefault():
+        source = None
+    if source is not None:
+        path = '%s.%s' % (path, source.name)
+    if scope is None:
+        return path, checksum((), source)
+    params = [sorted(scope.tlds), scope.min_population]
+    return '%s.%s' % (path, scope.key), checksum(params, source)
+
+
+def findGlobal(module, name):
+    # Resolve pickled classes independently of how they were imported
+    base = module.split('.')[-1]
+    if base in LOCAL_MODULES:
+        module = PACKAGE_PREFIX + base
+    __import__(module)
+    return getattr(sys.modules[module], name)
+
+
+'''Serialise the processed lookup structures (a dict) to path.'''
+def save(path, fingerprint, data):
+    # Write to a temporary file first, so that concurrent readers never
+    # see a half-written snapshot
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    f = open(tmp_path, 'wb')
+    cPickle.dump(SNAPSHOT_VERSION, f, cPickle.HIGHEST_PROTOCOL)
+    cPickle.dump(fingerprint, f, cPickle.HIGHEST_PROTOCOL)
+    cPickle.dump(data, f, cPickle.HIGHEST_PROTOCOL)
+    f.close()
+    os.rename(tmp_path, path)
+
+
+'''Load the lookup structures from path. Returns None if there is no
+snapshot, or if it was built by another version or from other data.'''
+def load(path, fingerprint):
+    if not os.path.exists(path):
+        return None
+    f = open(path, 'rb')
+    # The snapshot holds millions of small containers; there are no cycles
+    # to collect while loading them
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        unpickler = cPickle.Unpickler(f)
+        unpickler.find_global = findGlobal
+        if unpickler.load() != SNAPSHOT_VERSION:
+            return None
+        if unpickler.load() != fingerprint:
+            return None
+        return unpickler.load()
+    except (EOFError, cPickle.UnpicklingError, ImportError, AttributeError):
+        # Truncated or otherwise unreadable: treat as missing
+        return None
+    finally:
+        if gc_enabled:
+            gc.enable()
+        f.close()
+
+
+if __name__=="__main__":
+    # Build step: (re)create the snapshot from the CSV files
+    from countryGuesser import CountryGuesser
+    if os.path.exists(SNAPSHOT_PATH):
+        os.remove(SNAPSHOT_PATH)
+    CountryGuesser(snapshot=SNAPSHOT_PATH)
+    print 'Snapshot written to', SNAPSHOT_PATH, '(%d bytes)' % os.path.getsize(SNAPSHOT_PATH)
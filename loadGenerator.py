@@ -0,0 +1,348 @@
+# This Python file uses the following encoding: utf-8
+
+"""Copyright 2014 Bogdan Vasilescu
+Eindhoven University of Technology
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+# Synthetic location corpora of any size, for load tests (see
+# scalingHarness), built from the data files of the project:
+#
+#   python loadGenerator.py --rows 1000000 --seed 0 -o corpus.txt
+#
+# Locations are made like those of data/sample.csv: cities (with their
+# diacritics, big cities more often), alone or with their state, state
+# abbreviation, country, TLD or post code, in various separators; country
+# and state names; several cities; addresses; typos and junk. Rows are
+# drawn from a smaller set of distinct locations, with Zipf-distributed
+# frequencies ("london" comes back far more often than most), as in real
+# profile data. The same seed and data files always give the same corpus.
+
+import os
+import sys
+import csv
+import random
+import bisect
+import argparse
+
+import dataRegistry
+from cityIndexBuilder import CITIES_PATH, COL_COUNTRY_CODE, COL_FEATURE_CLASS, COL_POPULATION, POPULATED_PLACE
+
+this_dir, this_filename = os.path.split(__file__)
+DATA_PATH = os.path.join(this_dir, 'data')
+
+# Columns of the GeoNames dump: the name as written (with diacritics), in
+# ASCII, and the state (for the USA, its abbreviation)
+COL_RAW_NAME = 1
+COL_ASCII_NAME = 2
+COL_ADMIN1 = 10
+
+# Share of cities written with their diacritics (the others in ASCII)
+DIACRITICS = 0.4
+
+# Share of distinct locations among the rows, and Zipf exponent of their
+# frequencies (with 0.8, the most frequent location is a few percent of
+# the rows)
+DISTINCT = 0.3
+ZIPF = 0.8
+
+# Post code formats of the countries of PostCodes (# digit, A letter)
+POST_CODE_FORMATS = {
+    'us':'#####', 'uk':'A# #AA', 'de':'#####', 'ca':'A#A #A#', 'fr':'#####', 'it':'#####',
+    'au':'####', 'nl':'#### AA', 'es':'#####', 'dk':'####', 'se':'### ##', 'be':'####',
+}
+
+# Locations no rule resolves (no place names, not even in transliteration)
+JUNK = [u'earth', u'planet earth', u'the internet', u'localhost', u'127.0.0.1', u'everywhere',
+        u'somewhere', u'worldwide', u'home', u'remote', u'cyberspace', u'online', u'n/a', u'-',
+        u'???', u'( • ∀•)', u'☃', u'地球', u'http://example.com',
+        u'in the middle of nowhere', u'between jobs', u'on the move']
+
+STREETS = [u'main street', u'white road', u'high street', u'station road', u'church lane',
+           u'oak avenue', u'park road', u'market square']
+
+SEPARATORS = [u', '] * 8 + [u',', u' - ', u' / ', u' ', u'/', u' | ']
+
+# Kinds of locations, and how often they occur (out of the total)
+KINDS = [
+    ('city', 22), ('city, country', 23), ('city, state', 8), ('city, state abbrev', 9),
+    ('city, state, country', 7), ('city, tld', 2), ('country', 7), ('state', 3),
+    ('cities', 5), ('address', 2), ('post code city', 1), ('typo', 5), ('junk', 6),
+]
+
+
+'''Running totals of weights, to pick items by with bisect.'''
+def _cumulative(weights):
+    total = 0
+    cumulative = []
+    for w in weights:
+        total += w
+        cumulative.append(total)
+    return cumulative
+
+
+'''The p-th percentile of sorted values.'''
+def _percentile(values, p):
+    return values[int(round(p / 100.0 * (len(values) - 1)))] if len(values) else None
+
+
+'''Statistics of a list of locations: rows, distinct share, length
+percentiles, and the share of locations with commas, digits, and
+non-ASCII characters.'''
+def describe(locations):
+    n = len(locations)
+    lengths = sorted([len(location) for location in locations])
+    share = lambda test: round(sum([1 for location in locations if test(location)]) / float(max(n, 1)), 3)
+    return {
+        'rows':n,
+        'distinct':round(len(set(locations)) / float(max(n, 1)), 3),
+        'length_p10':_percentile(lengths, 10),
+        'length_p50':_percentile(lengths, 50),
+        'length_p90':_percentile(lengths, 90),
+        'length_p99':_percentile(lengths, 99),
+        'length_max':lengths[-1] if n else None,
+        'commas':share(lambda l: u',' in l),
+        'digits':share(lambda l: any([c.isdigit() for c in l])),
+        'non_ascii':share(lambda l: any([ord(c) > 127 for c in l])),
+    }
+
+
+class LoadGenerator:
+    '''Generates synthetic locations from the data files: countries.csv,
+    the state lists, the cities of the GeoNames dump at path (see
+    CityIndexBuilder for delimiter) and POST_CODE_FORMATS. countries
+    (WorldCountries) defaults to the shared instance of dataRegistry.'''
+
+    def __init__(self, seed=0, countries=None, path=CITIES_PATH, delimiter=';'):
+        if countries is None:
+            countries = dataRegistry.get('WorldCountries')
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.tld2name = countries.tld2name
+
+        # Country name -> its names and alternatives, and its TLDs
+        self.countryNames = sorted(set(countries.alternative2name.itervalues()))
+        self.name2variants = dict([(name, sorted(countries.name2alternatives[name]))
+                                   for name in self.countryNames])
+        self.name2tlds = {}
+        for (tld, name) in sorted(countries.tld2name.iteritems()):
+            self.name2tlds.setdefault(name, []).append(tld)
+
+        # Country name -> (state names, abbreviations)
+        self.states = {}
+        for (dataset, country) in [('USAStates', 'usa'), ('CanadaProvinces', 'canada'), ('BrazilStates', 'brazil')]:
+            states = dataRegistry.get(dataset)
+            self.states[countries.alternative2name[country]] = (sorted(states.namesSet), sorted(states.abbrevsSet))
+
+        # Country name -> post code format
+        self.postCodeFormats = dict([(countries.tld2name[tld], f) for (tld, f) in POST_CODE_FORMATS.iteritems()])
+
+        # The cities, and cumulative weights to pick them by (square root
+        # of) population
+        self.cities = []
+        self.weights = []
+        total = 0.0
+        f = open(path, 'rb')
+        if delimiter == '\t':
+            reader = csv.reader(f, delimiter=delimiter, quoting=csv.QUOTE_NONE)
+        else:
+            reader = csv.reader(f, delimiter=delimiter)
+        for row in reader:
+            if row[COL_FEATURE_CLASS] not in ('', POPULATED_PLACE):
+                continue
+            country = countries.tld2name.get(row[COL_COUNTRY_CODE].lower())
+            name = unicode(row[COL_RAW_NAME], 'utf-8').strip()
+            if country is None or not len(name):
+                continue
+            self.cities.append((name, unicode(row[COL_ASCII_NAME], 'utf-8').strip() or name,
+                                country, row[COL_ADMIN1]))
+            total += max(int(row[COL_POPULATION] or 0), 1000) ** 0.5
+            self.weights.append(total)
+        f.close()
+
+        self.kinds = [kind for (kind, _) in KINDS]
+        self.kindWeights = _cumulative([w for (_, w) in KINDS])
+
+
+    def __pick(self, items, cumulative):
+        return items[bisect.bisect_right(cumulative, self.random.random() * cumulative[-1])]
+
+
+    '''A city, as (name, country, state code).'''
+    def __city(self):
+        (name, ascii, country, admin1) = self.__pick(self.cities, self.weights)
+        return (name if self.random.random() < DIACRITICS else ascii, country, admin1)
+
+
+    '''One of the names of country, mostly the main one.'''
+    def __country(self, country):
+        if self.random.random() < 0.7:
+            return country
+        return self.random.choice(self.name2variants[country])
+
+
+    '''A state name or abbreviation of country (for US cities, their own
+    state), or None if no state list covers it.'''
+    def __state(self, country, admin1, abbrev):
+        if country not in self.states:
+            return None
+        (names, abbrevs) = self.states[country]
+        if abbrev:
+            if admin1.lower() in abbrevs:
+                return admin1.lower()
+            return self.random.choice(abbrevs)
+        return self.random.choice(names)
+
+
+    def __postCode(self, country):
+        digits = u'0123456789'
+        letters = u'ABCEGHJKLMNPRSTVWXYZ'
+        code = self.postCodeFormats.get(country, u'#####')
+        return u''.join([self.random.choice(digits) if c == '#' else
+                         self.random.choice(letters) if c == 'A' else c for c in code])
+
+
+    '''A copy of text with one typo (deleted, swapped, replaced or added
+    letter) in a longer word.'''
+    def __typo(self, text):
+        words = text.split(u' ')
+        long = [i for (i, w) in enumerate(words) if len(w) >= 5]
+        if not len(long):
+            return text
+        i = self.random.choice(long)
+        w = words[i]
+        k = self.random.randrange(1, len(w) - 1)
+        edit = self.random.randrange(4)
+        if edit == 0:
+            w = w[:k] + w[k+1:]
+        elif edit == 1:
+            w = w[:k] + w[k+1] + w[k] + w[k+2:]
+        elif edit == 2:
+            w = w[:k] + self.random.choice(u'aeiounrst') + w[k+1:]
+        else:
+            w = w[:k] + self.random.choice(u'aeiounrst') + w[k:]
+        words[i] = w
+        return u' '.join(words)
+
+
+    '''Case and spacing as people type them.'''
+    def __noise(self, text):
+        r = self.random.random()
+        if r < 0.6:
+            text = text.lower()
+        elif r < 0.65:
+            text = text.upper()
+        if self.random.random() < 0.03:
+            text = u' ' + text + u' '
+        if self.random.random() < 0.02:
+            text = text + self.random.choice([u'.', u'!', u'\\', u' :)'])
+        return text
+
+
+    '''One synthetic location.'''
+    def location(self):
+        kind = self.__pick(self.kinds, self.kindWeights)
+        sep = self.random.choice(SEPARATORS)
+        if kind == 'country':
+            return self.__noise(self.__country(self.random.choice(self.countryNames)))
+        if kind == 'junk':
+            return self.random.choice(JUNK)
+
+        (city, country, admin1) = self.__city()
+        if kind == 'city':
+            text = city
+        elif kind == 'city, country':
+            text = city + sep + self.__country(country)
+        elif kind in ('city, state', 'city, state abbrev', 'state'):
+            state = self.__state(country, admin1, kind == 'city, state abbrev')
+            if state is None:
+                text = city + sep + self.__country(country)
+            elif kind == 'state':
+                text = state
+            else:
+                text = city + sep + state
+        elif kind == 'city, state, country':
+            state = self.__state(country, admin1, self.random.random() < 0.5)
+            if state is None:
+                # A city of the same country as a region
+                state = self.__city()[0]
+            text = city + sep + state + sep + self.__country(country)
+        elif kind == 'city, tld':
+            text = city + sep + self.random.choice([u'', u'.']) + self.random.choice(self.name2tlds[country])
+        elif kind == 'cities':
+            text = city + sep + self.__city()[0]
+            if self.random.random() < 0.3:
+                text += sep + self.__city()[0]
+        elif kind == 'address':
+            text = u'%d %s, %s' % (self.random.randrange(1, 2000), self.random.choice(STREETS), city)
+            state = self.__state(country, admin1, True)
+            text += u', ' + (state if state is not None else self.__country(country))
+            text += u' ' + self.__postCode(country)
+        elif kind == 'post code city':
+            text = self.__postCode(country) + u' ' + city
+        else:
+            text = self.__typo(city.lower() if self.random.random() < 0.5 else
+                               city.lower() + u', ' + self.__country(country))
+        return self.__noise(text)
+
+
+    '''A corpus of rows locations, drawn from rows * distinct distinct
+    ones with Zipf(zipf) frequencies, in random order. Depends only on
+    the seed and the arguments.'''
+    def corpus(self, rows, distinct=DISTINCT, zipf=ZIPF):
+        self.random = random.Random(self.seed)
+        pool = []
+        seen = set()
+        size = max(1, int(rows * distinct))
+        # Generated locations repeat too; keep drawing until enough are
+        # distinct (bounded, for tiny data sets)
+        for _ in xrange(20 * size):
+            if len(pool) >= size:
+                break
+            location = self.location()
+            if location not in seen:
+                seen.add(location)
+                pool.append(location)
+        ranks = _cumulative([1.0 / (r ** zipf) for r in xrange(1, len(pool) + 1)])
+        # Every distinct location occurs at least once
+        locations = pool[:min(len(pool), rows)]
+        locations.extend([self.__pick(pool, ranks) for _ in xrange(rows - len(locations))])
+        self.random.shuffle(locations)
+        return locations
+
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(description='Generate a synthetic location corpus.')
+    parser.add_argument('--rows', type=int, default=100000,
+                        help='locations to generate (default: 100000)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed (default: 0)')
+    parser.add_argument('--distinct', type=float, default=DISTINCT,
+                        help='share of distinct locations (default: %s)' % DISTINCT)
+    parser.add_argument('--zipf', type=float, default=ZIPF,
+                        help='Zipf exponent of the frequencies (default: %s)' % ZIPF)
+    parser.add_argument('-o', '--output', default='-',
+                        help='output file, one location per line (default: stdout)')
+    return parser.parse_args(argv)
+
+
+if __name__=="__main__":
+    args = parseArgs(sys.argv[1:])
+    locations = LoadGenerator(args.seed).corpus(args.rows, args.distinct, args.zipf)
+    f = sys.stdout if args.output == '-' else open(args.output, 'wb')
+    for location in locations:
+        f.write(location.encode('utf-8') + '\n')
+    if f is not sys.stdout:
+        f.close()
+    print >>sys.stderr, describe(locations)
@@ -0,0 +1,75 @@
+# This Python file uses the following encoding: utf-8
+
+"""Copyright 2014 Bogdan Vasilescu
+Eindhoven University of Technology
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+import re
+
+ALPHA = re.compile(r'[A-Za-z]+')
+DIGITS = '0123456789'
+
+
+class LocationAnalysis:
+    '''The views of a normalised location string that the rules of
+    CountryGuesser work on, computed once per location:
+
+        text           the normalised location
+        commaParts     non-empty comma-separated parts, stripped
+        parts          alphabetic tokens (maximal runs of A-Za-z)
+        offsets        start offset in text of each token
+        lastCommaTokens  the tokens of the last comma part
+        trailingNumber the number the last comma part ends with, or None
+        lastToken      the last token, or None
+
+    All sequences are tuples; the analysis is shared by all rules and must
+    not be modified.'''
+
+    def __init__(self, location_norm):
+        self.text = location_norm
+
+        commaParts = []
+        lastStart = 0
+        position = 0
+        for piece in location_norm.split(','):
+            part = piece.strip()
+            if len(part):
+                commaParts.append(part)
+                lastStart = position
+            position += len(piece) + 1
+        self.commaParts = tuple(commaParts)
+
+        matches = [(m.group(), m.start()) for m in ALPHA.finditer(location_norm)]
+        self.parts = tuple([token for (token, _) in matches])
+        self.offsets = tuple([offset for (_, offset) in matches])
+        self.lastToken = self.parts[-1] if len(self.parts) else None
+
+        # Only empty parts can follow the last comma part, and those have
+        # no tokens: its tokens are all those from where it starts
+        self.lastCommaTokens = tuple([token for (token, offset) in matches if offset >= lastStart])
+
+        self.trailingNumber = None
+        if len(commaParts):
+            last = commaParts[-1]
+            digits = len(last) - len(last.rstrip(DIGITS))
+            if digits:
+                self.trailingNumber = last[-digits:]
+
+
+if __name__=="__main__":
+    a = LocationAnalysis('773 white road, bowdoinham, me 04008')
+    print a.commaParts
+    print a.parts
+    print a.lastCommaTokens, a.trailingNumber, a.lastToken
@@ -0,0 +1,73 @@
+# This Python file uses the following encoding: utf-8
+
+"""Copyright 2014 Bogdan Vasilescu
+Eindhoven University of Technology
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+from collections import OrderedDict
+
+
+class LRUCache:
+    '''Dictionary holding at most size entries. When full, the least
+    recently used entry is evicted.'''
+
+    def __init__(self, size):
+        self.size = size
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def get(self, key, default=None):
+        try:
+            value = self.data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        # Move to the most recently used end
+        self.data[key] = value
+        self.hits += 1
+        return value
+
+
+    def put(self, key, value):
+        if key in self.data:
+            del self.data[key]
+        elif len(self.data) >= self.size:
+            self.data.popitem(last=False)
+            self.evictions += 1
+        self.data[key] = value
+
+
+    '''Remove all entries and reset the counters.'''
+    def clear(self):
+        self.data.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def stats(self):
+        return {'size':len(self.data), 'max_size':self.size, 'hits':self.hits,
+                'misses':self.misses, 'evictions':self.evictions}
+
+
+    def __len__(self):
+        return len(self.data)
+
+
+    def __contains__(self, key):
+        return key in self.data
@@ -0,0 +1,307 @@
+# This Python file uses the following encoding: utf-8
+
+"""Copyright 2014 Bogdan Vasilescu
+Eindhoven University of Technology
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+# The city index (name automaton and population postings) as one flat,
+# memory-mappable file. All processes on a host mapping the same file
+# share one physical copy of it through the page cache, and opening it
+# costs next to nothing: pages are read when first used.
+# CountryGuesser(mapped=path) (re)writes the file first when it is
+# missing or stale.
+#
+# Layout: MAGIC, the length of the header (4 bytes), the header (JSON:
+# version, fingerprint, byte order, country names, and the offset, type
+# code and length of every section), then the sections, 8-byte aligned.
+# A section is an array of fixed-size numbers in native byte order, or
+# raw bytes (type code 'c').
+
+import os
+import sys
+import json
+import mmap
+import struct
+from array import array
+
+from ahoCorasick import AhoCorasick, asBytes
+from worldCities import WorldCities, CityView
+
+this_dir, this_filename = os.path.split(__file__)
+DATA_PATH = os.path.join(this_dir, 'data')
+
+# Default location of the mapped index
+MAPPED_PATH = os.path.join(DATA_PATH, 'index.mmap')
+
+MAGIC = 'CNMIDX\r\n'
+
+# Bump whenever the layout of the file changes
+MAPPED_VERSION = 1
+
+ALIGNMENT = 8
+
+
+class MappedArray:
+    '''Read-only array of numbers stored in a buffer (e.g., an mmap),
+    starting at offset. Elements are decoded when accessed.'''
+
+    def __init__(self, buf, offset, typecode, length):
+        self.buf = buf
+        self.offset = offset
+        self.length = length
+        self.itemsize = struct.calcsize('=' + typecode)
+        self.unpack = struct.Struct('=' + typecode).unpack_from
+
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError('MappedArray index out of range')
+        return self.unpack(self.buf, self.offset + i * self.itemsize)[0]
+
+
+    def __len__(self):
+        return self.length
+
+
+class MappedBytes:
+    '''Read-only string stored in a buffer, as far as AhoCorasick needs it.'''
+
+    def __init__(self, buf, offset, length):
+        self.buf = buf
+        self.offset = offset
+        self.length = length
+
+
+    def find(self, sub, start=0, end=None):
+        if end is None or end > self.length:
+            end = self.length
+        i = self.buf.find(sub, self.offset + start, self.offset + end)
+        return i - self.offset if i >= 0 else -1
+
+
+    def __len__(self):
+        return self.length
+
+
+class MappedStrings:
+    '''Read-only list of strings stored back to back in a buffer; string i
+    spans offsets[i] until offsets[i+1] (relative to offset).'''
+
+    def __init__(self, buf, offset, offsets):
+        self.buf = buf
+        self.offset = offset
+        self.offsets = offsets
+
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        return self.buf[self.offset + self.offsets[i]:self.offset + self.offsets[i + 1]]
+
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+
+class MappedAhoCorasick(AhoCorasick):
+    '''AhoCorasick whose arrays live in a mapped index file.'''
+
+    def __init__(self, patterns, labels, base, targets, fail, out, link):
+        self.patterns = patterns
+        self.labels = labels
+        self.base = base
+        self.targets = targets
+        self.fail = fail
+        self.out = out
+        self.link = link
+
+
+class MappedCities(WorldCities):
+    '''WorldCities whose postings live in a mapped index file. The id of a
+    name is its pattern id in the automaton, found by an exact walk of the
+    trie; no dictionary of names is held in memory.'''
+
+    def __init__(self, automaton, countries, offsets, postingCountries, postingPopulations,
+                 postingNameLengths, MIN_CITY_LENGTH=5, MIN_POPULATION=50000):
+        self.MIN_CITY_LENGTH = MIN_CITY_LENGTH
+        self.MIN_POPULATION = MIN_POPULATION
+        self.automaton = automaton
+        self.countries = countries
+        self.country2id = dict([(c, i) for (i, c) in enumerate(countries)])
+        self.offsets = offsets
+        self.postingCountries = postingCountries
+        self.postingPopulations = postingPopulations
+        self.postingNameLengths = postingNameLengths
+
+        self.city2countryPopulation = CityView(self, 0, self.MIN_CITY_LENGTH)
+        self.largeCity2countryPopulation = CityView(self, self.MIN_POPULATION, self.MIN_CITY_LENGTH)
+
+
+    def nameId(self, city):
+        return self.automaton.lookup(city)
+
+
+    def names(self):
+        return iter(self.automaton.patterns)
+
+
+class MappedIndex:
+    '''An opened index file: automaton (MappedAhoCorasick) and cities
+    (MappedCities) read from the mapping.'''
+
+    def __init__(self, path):
+        self.path = path
+        f = open(path, 'rb')
+        try:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            # The mapping stays valid after the file is closed
+            f.close()
+
+        if self.mm[:len(MAGIC)] != MAGIC:
+            raise ValueError('not an index file: %s' % path)
+        (size,) = struct.unpack_from('<I', self.mm, len(MAGIC))
+        start = len(MAGIC) + 4
+        self.header = json.loads(self.mm[start:start + size])
+        self.fingerprint = self.header['fingerprint']
+
+        # Everything else only makes sense for the right version and platform
+        if self.header['version'] != MAPPED_VERSION or self.header['byteorder'] != sys.byteorder:
+            self.automaton = None
+            self.cities = None
+            return
+
+        section = self.__section
+        names = MappedStrings(self.mm, section('names').offset, section('nameOffsets'))
+        self.automaton = MappedAhoCorasick(names, section('labels'), section('base'),
+                                           section('targets'), section('fail'),
+                                           section('out'), section('link'))
+        self.cities = MappedCities(self.automaton, [unicode(c) for c in self.header['countries']],
+                                   section('offsets'), section('postingCountries'),
+                                   section('postingPopulations'), section('postingNameLengths'))
+
+
+    def __section(self, name):
+        offset, typecode, length = self.header['sections'][name]
+        if offset + length * struct.calcsize('=' + typecode) > len(self.mm):
+            raise ValueError('truncated index file: %s' % self.path)
+        if typecode == 'c':
+            return MappedBytes(self.mm, offset, length)
+        return MappedArray(self.mm, offset, str(typecode), length)
+
+
+    def close(self):
+        self.mm.close()
+
+
+
+'''Write cities (WorldCities) and the automaton over all their names (see
+CityMatcher) as a mapped index file.'''
+def save(path, fingerprint, cities, automaton):
+    sections = []
+    sections.append(('labels', 'c', automaton.labels))
+    for name in ['base', 'targets', 'fail', 'out', 'link']:
+        sections.append((name, 'i', array('i', getattr(automaton, name))))
+
+    # Names and postings, in automaton pattern id order
+    names = []
+    nameOffsets = array('i', [0])
+    offsets = array('i', [0])
+    postingCountries = array('H')
+    postingPopulations = array('i')
+    postingNameLengths = array('B')
+    for name in automaton.patterns:
+        name = asBytes(name)
+        names.append(name)
+        nameOffsets.append(nameOffsets[-1] + len(name))
+        i = cities.nameId(name)
+        for k in xrange(cities.offsets[i], cities.offsets[i + 1]):
+            postingCountries.append(cities.postingCountries[k])
+            postingPopulations.append(cities.postingPopulations[k])
+            postingNameLengths.append(cities.postingNameLengths[k])
+        offsets.append(len(postingCountries))
+    sections.append(('names', 'c', ''.join(names)))
+    sections.append(('nameOffsets', 'i', nameOffsets))
+    sections.append(('offsets', 'i', offsets))
+    sections.append(('postingCountries', 'H', postingCountries))
+    sections.append(('postingPopulations', 'i', postingPopulations))
+    sections.append(('postingNameLengths', 'B', postingNameLengths))
+
+    blobs = [data if typecode == 'c' else data.tostring() for (_, typecode, data) in sections]
+    header = {
+        'version':MAPPED_VERSION,
+        'fingerprint':fingerprint,
+        'byteorder':sys.byteorder,
+        'countries':cities.countries,
+        'sections':{},
+    }
+    # The header holds the section offsets, which depend on the size of
+    # the header: grow the room for the header until it fits
+    align = lambda n: (n + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+    size = 0
+    while True:
+        offset = size
+        for ((name, typecode, data), blob) in zip(sections, blobs):
+            header['sections'][name] = [offset, typecode, len(data)]
+            offset += align(len(blob))
+        encoded = json.dumps(header)
+        if len(MAGIC) + 4 + len(encoded) <= size:
+            break
+        size = align(len(MAGIC) + 4 + len(encoded))
+
+    # Write to a temporary file first, so that processes mapping the
+    # current file are not affected
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    f = open(tmp_path, 'wb')
+    f.write(MAGIC)
+    f.write(struct.pack('<I', size - len(MAGIC) - 4))
+    f.write(encoded.ljust(size - len(MAGIC) - 4))
+    for blob in blobs:
+        f.write(blob)
+        f.write('\0' * (align(len(blob)) - len(blob)))
+    f.close()
+    os.rename(tmp_path, path)
+
+
+'''Open the index file at path. Returns None if there is none, or if it
+was built by another version, on another platform or from other data.'''
+def load(path, fingerprint):
+    if not os.path.exists(path):
+        return None
+    try:
+        index = MappedIndex(path)
+    except (ValueError, struct.error, KeyError, mmap.error, EnvironmentError):
+        # Truncated or otherwise unreadable: treat as missing
+        return None
+    if index.cities is None or index.fingerprint != fingerprint:
+        index.close()
+        return None
+    return index
+
+
+if __name__=="__main__":
+    # Build step: (re)create the mapped index from the CSV files
+    from countryGuesser import CountryGuesser
+    if os.path.exists(MAPPED_PATH):
+        os.remove(MAPPED_PATH)
+    CountryGuesser(snapshot=None, mapped=MAPPED_PATH)
+    print 'Mapped index written to', MAPPED_PATH, '(%d bytes)' % os.path.getsize(MAPPED_PATH)
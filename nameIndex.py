@@ -0,0 +1,61 @@
+# This Python file uses the following encoding: utf-8
+
+"""Copyright 2014 Bogdan Vasilescu
+Eindhoven University of Technology
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+import re
+from ahoCorasick import AhoCorasick
+
+
+class NameIndex:
+    '''Index over a set of names (countries, states) for finding the names
+    that occur in a normalised location string. Single-word names must
+    match a whole alphabetic part of the string. Multi-word names
+    ('united states', 'st. lucia') may occur anywhere; they are found in
+    one pass by an Aho-Corasick automaton compiled once.'''
+
+    def __init__(self, namesSet):
+        self.namesSet = namesSet
+        # When multi-word names overlap, the one replaced first wins the
+        # overlapping text. Keep the iteration order of namesSet for that.
+        self.multiwords = [c for c in namesSet if len(c.split())>1 or len(c.split('.'))>1]
+        self.rank = dict([(w, i) for (i, w) in enumerate(self.multiwords)])
+        self.automaton = AhoCorasick(self.multiwords)
+
+
+    '''Split a string into parts on any non-alphabetic character.
+    Multi-word names occurring in the string do not get split. tokens
+    are the alphabetic parts of the whole string, if already known
+    (see LocationAnalysis); they are the answer when there are no
+    multi-word names in it.'''
+    def parts(self, location_norm, tokens=None):
+        parts = sorted(self.automaton.findall(location_norm), key=self.rank.get)
+        if not len(parts) and tokens is not None:
+            return list(tokens)
+        rest = location_norm
+        for word in parts:
+            rest = rest.replace(word, ' ')
+        parts.extend(re.split(r'[^A-Za-z]', rest))
+        return [p for p in parts if len(p)]
+
+
+    '''Return the names occurring in location_norm.'''
+    def search(self, location_norm, tokens=None):
+        return self.namesSet.intersection(self.parts(location_norm, tokens))
+
+
+    def __len__(self):
+        return len(self.namesSet)
@@ -0,0 +1,82 @@
+# This Python file uses the following encoding: utf-8
+
+"""Copyright 2014 Bogdan Vasilescu
+Eindhoven University of Technology
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+# Normalisation of names and locations, shared by the loaders and by
+# CountryGuesser: transliterate / remove diacritics / convert to lower case.
+# Gives the same results as unidecode(s).lower().strip(), but:
+#  - ASCII strings (most inputs, most GeoNames names) are not transliterated
+#    at all: unidecode leaves ASCII characters as they are
+#  - transliterations of other strings are cached, since the same
+#    locations come back many times
+
+from unidecode import unidecode
+
+# Bound on the number of cached transliterations; the cache is emptied
+# when full, which is cheap and keeps the frequent strings coming back
+MAX_CACHED = 100000
+
+_cache = {}
+
+
+'''Same as unidecode(text).'''
+def transliterate(text):
+    if isinstance(text, unicode):
+        # Cheaper than catching UnicodeEncodeError for the other strings
+        ascii = text.encode('ascii', 'ignore')
+        if len(ascii) == len(text):
+            return ascii
+        ascii = _cache.get(text)
+        if ascii is None:
+            if len(_cache) >= MAX_CACHED:
+                _cache.clear()
+            ascii = _cache[text] = unidecode(text)
+        return ascii
+    # Byte strings: ASCII ones are returned as they are, anything else is
+    # left to unidecode (as before)
+    try:
+        text.decode('ascii')
+        return text
+    except UnicodeDecodeError:
+        return unidecode(text)
+
+
+'''Transliterate / remove diacritics / convert to lower case.'''
+def normalize(text):
+    return transliterate(text).lower().strip()
+
+
+'''normalize each part of text, split on separator. For lists of names
+in the data files: when the whole list is ASCII, it is checked once
+rather than name by name. Names are mostly unique, so other names are
+transliterated without going through the cache.'''
+def normalizeAll(text, separator=','):
+    if isinstance(text, unicode):
+        ascii = text.encode('ascii', 'ignore')
+        if len(ascii) == len(text):
+            return [part.lower().strip() for part in ascii.split(separator)]
+        return [unidecode(part).lower().strip() for part in text.split(separator)]
+    return [normalize(part) for part in text.split(separator)]
+
+
+def clearCache():
+    _cache.clear()
+
+
+if __name__=="__main__":
+    for s in [u'Eindhoven', u'S\xe3o Paulo', u'Москва', 'Berlin ']:
+        print repr(s), repr(normalize(s)), normalize(s) == unidecode(s).lower().strip()
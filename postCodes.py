@@ -41,6 +41,35 @@ class PostCodes:
             'se':compile_rex(r'(s-|S-){0,1}[0-9]{3}\s?[0-9]{2}'),
             'be':compile_rex(r'[1-9]{1}[0-9]{3}')
         }
+        
+        
+        # Length of the run of consecutive digits each pattern needs. All
+        # patterns need at least one digit, and most locations have none.
+        # Countries missing here are always tried.
+        self.minDigits = {'us':5, 'uk':1, 'de':5, 'ca':1, 'fr':3, 'it':5,
+                          'au':4, 'nl':4, 'es':5, 'dk':4, 'se':3, 'be':4}
+        self.digits = compile_rex(r'\d+')
+        
+        # Patterns ordered by the digits they need, so a scan stops at the
+        # first pattern that cannot match
+        self.byMinDigits = sorted([(self.minDigits.get(tld, 1), tld, rex)
+                                   for tld, rex in self.regex.iteritems()])
+    
+    
+    '''Return the TLDs of the countries whose post code format occurs
+    in location_norm.'''
+    def search(self, location_norm):
+        runs = self.digits.findall(location_norm)
+        if not len(runs):
+            return set()
+        longest = max([len(r) for r in runs])
+        found = set()
+        for (n, tld, rex) in self.byMinDigits:
+            if n > longest:
+                break
+            if rex.search(location_norm) is not None:
+                found.add(tld)
+        return found
 
 
 if __name__=="__main__":
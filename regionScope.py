@@ -0,0 +1,130 @@
+# This Python file uses the following encoding: utf-8
+
+"""Copyright 2014 Bogdan Vasilescu
+Eindhoven University of Technology
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+# The countries a guesser cares about, for deployments that only need a
+# few of them:
+#
+#   cg = CountryGuesser(scope=['netherlands', 'be', 'dach'])
+#
+# Only the cities of these countries are loaded, and the big cities of
+# the others: the small cities are nearly all of the memory and startup
+# time. Country names, TLDs, states and post code formats are still
+# recognised for all countries (they are few), so a location pointing
+# elsewhere, such as "paris, france" or "auckland", gets OTHER. Without
+# the big cities, such locations would lose the votes that outweigh
+# same-named small places in scope ("amersfoort, nl" is also a village in
+# Canada). Small cities elsewhere no longer count as clues; their
+# locations get None (or an answer in scope) instead of OTHER.
+#
+# A scope is a RegionScope, or its countries and regions (a list, or a
+# comma-separated string). The snapshot and mapped index of a scope are
+# files of their own, next to the given path. Ambiguous post codes stay
+# ambiguous, and lowering min_population with with_thresholds does not
+# bring back the smaller cities elsewhere.
+
+import hashlib
+
+from normalization import normalize
+
+# The answer for countries outside the scope
+OTHER = 'other'
+
+# Groups of countries that can be named in a scope, by TLD
+REGIONS = {
+    'benelux': ['be', 'nl', 'lu'],
+    'dach': ['de', 'at', 'ch'],
+    'nordics': ['dk', 'fi', 'is', 'no', 'se'],
+    'north america': ['us', 'ca', 'mx'],
+    'eu': ['at', 'be', 'bg', 'cy', 'cz', 'de', 'dk', 'ee', 'es', 'fi', 'fr', 'gr', 'hr', 'hu',
+           'ie', 'it', 'lt', 'lu', 'lv', 'mt', 'nl', 'pl', 'pt', 'ro', 'se', 'si', 'sk'],
+}
+
+# Cities of countries outside the scope are kept from this population on:
+# the big cities of CountryGuesser (with its default thresholds)
+MIN_POPULATION = 100000
+
+# Longer keys (many countries) are hashed, to keep file names short
+MAX_KEY_LENGTH = 40
+
+
+class RegionScope:
+    '''A set of countries, given by names or alternatives of countries,
+    TLDs, or names of REGIONS. countries (WorldCountries) resolves them;
+    it defaults to the shared instance of dataRegistry. min_population
+    is the population from which the cities of other countries are kept.
+
+    names holds the country names, tlds all the 2-letter codes of these
+    countries, and key identifies the scope (e.g., in file names).'''
+
+    def __init__(self, scope, countries=None, min_population=MIN_POPULATION):
+        if countries is None:
+            import dataRegistry
+            countries = dataRegistry.get('WorldCountries')
+        if isinstance(scope, basestring):
+            scope = scope.split(',')
+
+        self.names = set()
+        for entry in scope:
+            entry = normalize(entry)
+            if not len(entry):
+                continue
+            if entry in REGIONS:
+                self.names.update([countries.tld2name[tld] for tld in REGIONS[entry]])
+            elif entry in countries.alternative2name:
+                self.names.add(countries.alternative2name[entry])
+            elif entry in countries.tld2name:
+                self.names.add(countries.tld2name[entry])
+            else:
+                raise ValueError('unknown country or region: %s' % entry)
+        if not len(self.names):
+            raise ValueError('empty scope')
+
+        self.tlds = set([tld for (tld, name) in countries.tld2name.iteritems() if name in self.names])
+        self.min_population = min_population
+        key = '-'.join(sorted(self.tlds))
+        if len(key) > MAX_KEY_LENGTH:
+            key = hashlib.md5(key).hexdigest()[:12]
+        self.key = '%s.%d' % (key, min_population)
+
+
+    def __contains__(self, country):
+        return country in self.names
+
+
+    '''True if the cities of the country with this code, with this
+    population, are loaded.'''
+    def keeps(self, code, population):
+        return code in self.tlds or population >= self.min_population
+
+
+    '''The countries of an answer of guess, with those outside the scope
+    replaced by OTHER (once). [None] stays as it is.'''
+    def restrict(self, countries):
+        restricted = []
+        for c in countries:
+            if c is not None and c not in self.names:
+                c = OTHER
+            if c not in restricted:
+                restricted.append(c)
+        return restricted
+
+
+if __name__=="__main__":
+    scope = RegionScope('benelux,germany')
+    print scope.key, sorted(scope.names)
+    print scope.restrict(['germany', 'france', 'italy'])
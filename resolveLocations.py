@@ -0,0 +1,263 @@
+# This Python file uses the following encoding: utf-8
+
+"""Copyright 2014 Bogdan Vasilescu
+Eindhoven University of Technology
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+# Command-line resolution of large location files:
+#
+#   python resolveLocations.py locations.csv -o countries.csv --column 0
+#   zcat export.jsonl.gz | python resolveLocations.py --format jsonl > out.jsonl
+#
+# The input is streamed in chunks, so memory use does not depend on the
+# size of the input. With --checkpoint, a crashed run started again with
+# the same arguments continues after the last completed chunk. With
+# --result-cache, answers are kept on disk, and later runs over largely
+# the same locations only resolve the new ones. With --scope, only the
+# data of the given countries is loaded.
+
+import os
+import sys
+import json
+import time
+import argparse
+from itertools import islice
+from unicodeManager import UnicodeReader, UnicodeWriter
+
+from countryGuesser import CountryGuesser
+
+
+FORMATS = ['csv', 'tsv', 'jsonl']
+OUTPUT_COLUMNS = ['location', 'countries', 'country', 'row']
+
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(description='Guess the countries of free-text locations.')
+    parser.add_argument('input', nargs='?', default='-',
+                        help='input file (default: stdin)')
+    parser.add_argument('-o', '--output', default='-',
+                        help='output file (default: stdout)')
+    parser.add_argument('--format', choices=FORMATS, default='csv',
+                        help='input and output format (default: csv)')
+    parser.add_argument('--delimiter', default=';',
+                        help='CSV delimiter (default: ;)')
+    parser.add_argument('--header', action='store_true',
+                        help='the first CSV/TSV row is a header')
+    parser.add_argument('--column',
+                        help='input column holding the location: an index, '
+                             'a header name, or a JSON key (default: 0, or '
+                             '"location" for jsonl)')
+    parser.add_argument('--output-columns', default='location,countries',
+                        help='comma-separated, from: %s. "countries" expands to '
+                             'one column per country in CSV (default: location,countries)'
+                             % ', '.join(OUTPUT_COLUMNS))
+    parser.add_argument('--chunk-size', type=int, default=10000,
+                        help='locations resolved per chunk (default: 10000)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='worker processes (default: 1)')
+    parser.add_argument('--cache-size', type=int, default=100000,
+                        help='memoised locations per process (default: 100000)')
+    parser.add_argument('--result-cache',
+                        help='SQLite file keeping the answers across runs (see resultCache)')
+    parser.add_argument('--scope',
+                        help='comma-separated countries, TLDs or regions to load; '
+                             'locations elsewhere resolve to "other" (see regionScope)')
+    parser.add_argument('--cities',
+                        help='GeoNames dump to read the cities from (default: data/cities1000.csv; '
+                             'prebuild its index with cityIndexBuilder)')
+    parser.add_argument('--checkpoint',
+                        help='file recording progress after every chunk; '
+                             'an existing checkpoint resumes the run')
+    parser.add_argument('--quiet', action='store_true',
+                        help='do not report progress on stderr')
+    args = parser.parse_args(argv)
+
+    args.output_columns = [c.strip() for c in args.output_columns.split(',') if len(c.strip())]
+    unknown = set(args.output_columns).difference(OUTPUT_COLUMNS)
+    if len(unknown):
+        parser.error('unknown output columns: %s' % ', '.join(sorted(unknown)))
+    if args.checkpoint and args.output == '-':
+        parser.error('--checkpoint needs an output file')
+    if args.format == 'tsv':
+        args.delimiter = '\t'
+    if args.column is None:
+        args.column = 'location' if args.format == 'jsonl' else '0'
+    return args
+
+
+'''Iterate over (row, location) pairs of the input stream.'''
+def readRows(f, args):
+    if args.format == 'jsonl':
+        for line in f:
+            line = line.strip()
+            if not len(line):
+                continue
+            obj = json.loads(line)
+            # Odd records (not an object, no text) get an empty location;
+            # the row is still written as it is
+            location = obj.get(args.column) if isinstance(obj, dict) else None
+            if isinstance(location, (int, long, float)) and not isinstance(location, bool):
+                # E.g., a post code given as a number
+                location = unicode(location)
+            elif not isinstance(location, basestring):
+                location = u''
+            yield obj, location
+        return
+
+    reader = UnicodeReader(f, delimiter=args.delimiter)
+    if args.column.isdigit():
+        column = int(args.column)
+        if args.header:
+            reader.next()
+    else:
+        if not args.header:
+            raise ValueError('a column name needs --header')
+        column = reader.next().index(args.column.decode('utf-8'))
+    for row in reader:
+        yield row, row[column] if column < len(row) else u''
+
+
+class RowWriter:
+    '''Writes one output record per input row, in the selected columns.'''
+
+    def __init__(self, f, args):
+        self.f = f
+        self.args = args
+        if args.format != 'jsonl':
+            self.writer = UnicodeWriter(f, delimiter=args.delimiter)
+
+
+    def write(self, row, location, countries):
+        if self.args.format == 'jsonl':
+            record = {}
+            for name in self.args.output_columns:
+                if name == 'location':
+                    record['location'] = location
+                elif name == 'countries':
+                    record['countries'] = [c for c in countries if c is not None]
+                elif name == 'country':
+                    record['country'] = countries[0]
+                elif name == 'row':
+                    record['row'] = row
+            self.f.write(json.dumps(record) + '\n')
+            return
+
+        cells = []
+        for name in self.args.output_columns:
+            if name == 'location':
+                cells.append(location)
+            elif name == 'countries':
+                cells.extend(countries)
+            elif name == 'country':
+                cells.append(countries[0] or u'')
+            elif name == 'row':
+                cells.extend(row)
+        self.writer.writerow(cells)
+
+
+'''Progress is recorded as the number of input rows done and the size of
+the output at that point, so output of an unfinished chunk can be cut.'''
+def readCheckpoint(path):
+    if path is None or not os.path.exists(path):
+        return 0, 0
+    f = open(path, 'rb')
+    state = json.load(f)
+    f.close()
+    return state['rows'], state['bytes']
+
+
+def writeCheckpoint(path, rows, size):
+    tmp_path = path + '.tmp'
+    f = open(tmp_path, 'wb')
+    json.dump({'rows':rows, 'bytes':size}, f)
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+    os.rename(tmp_path, path)
+
+
+def main(argv=None):
+    args = parseArgs(argv)
+
+    # CountryGuesser reports on stdout; keep stdout for the results only
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+
+    done, size = readCheckpoint(args.checkpoint)
+
+    fin = sys.stdin if args.input == '-' else open(args.input, 'rb')
+    if args.output == '-':
+        fout = stdout
+    elif done:
+        # Resuming: drop whatever was written after the last checkpoint
+        fout = open(args.output, 'r+b')
+        fout.truncate(size)
+        fout.seek(size)
+    else:
+        fout = open(args.output, 'wb')
+    writer = RowWriter(fout, args)
+
+    cg = CountryGuesser(cache_size=args.cache_size, result_cache=args.result_cache, scope=args.scope,
+                        cities=args.cities)
+    pool = cg.make_pool(args.workers) if args.workers > 1 else None
+
+    rows = readRows(fin, args)
+    if done:
+        for _ in islice(rows, done):
+            pass
+        if not args.quiet:
+            print >>sys.stderr, 'Resuming after', done, 'rows'
+
+    start = time.time()
+    resolved = 0
+    try:
+        while True:
+            chunk = list(islice(rows, args.chunk_size))
+            if not len(chunk):
+                break
+            locations = [location for (_, location) in chunk]
+            if pool is None:
+                answers = cg.guess_many(locations, workers=1)
+            else:
+                answers = cg.guess_many(locations, pool=pool, chunksize=max(1, len(chunk) / (4 * args.workers)))
+            for (row, location), countries in zip(chunk, answers):
+                writer.write(row, location, countries)
+            fout.flush()
+
+            done += len(chunk)
+            resolved += len(chunk)
+            if args.checkpoint:
+                os.fsync(fout.fileno())
+                writeCheckpoint(args.checkpoint, done, fout.tell())
+            if not args.quiet:
+                elapsed = time.time() - start
+                print >>sys.stderr, '%d rows done, %.0f rows/s' % (done, resolved / max(elapsed, 1e-9))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if fout is not stdout:
+        fout.close()
+    if fin is not sys.stdin:
+        fin.close()
+    if args.checkpoint and os.path.exists(args.checkpoint):
+        # Finished; a new run starts from scratch
+        os.remove(args.checkpoint)
+    sys.stdout = stdout
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,335 @@
+# This Python file uses the following encoding: utf-8
+
+"""Copyright 2014 Bogdan Vasilescu
+Eindhoven University of Technology
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+# A local resolution service: the index is loaded once, and many clients
+# share it over a unix socket (or TCP on localhost), speaking JSON lines:
+#
+#   python resolveService.py --socket /tmp/countries.sock
+#
+#   -> {"id": 1, "location": "eindhoven, the netherlands"}
+#   <- {"id": 1, "countries": ["netherlands"]}
+#   -> {"id": 2, "locations": ["paris", "ny, ny"]}
+#   <- {"id": 2, "countries": [["france"], ["united states"]]}
+#
+# Each connection is served by its own thread. Requests of all
+# connections go through one bounded queue to a batching thread, which
+# collects them into micro-batches (up to --max-batch locations, waiting
+# at most --max-wait-ms for more) and resolves each batch at once, in a
+# pool of worker processes with --workers > 1. When the queue is full,
+# requests wait up to --queue-timeout seconds and are then refused with
+# {"error": "busy"}, so that overload shows up at the clients instead of
+# as unbounded memory use.
+
+import os
+import sys
+import json
+import time
+import Queue
+import socket
+import signal
+import argparse
+import threading
+import SocketServer
+
+from countryGuesser import CountryGuesser
+from mappedIndex import MAPPED_PATH
+
+
+class Request:
+    '''Locations submitted together, and their answers once resolved.'''
+
+    def __init__(self, locations):
+        self.locations = locations
+        self.answers = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class Batcher:
+    '''Resolves the requests put into a bounded queue in micro-batches,
+    in a thread of its own. pool is an optional pool of worker processes
+    (see CountryGuesser.make_pool).'''
+
+    def __init__(self, cg, max_batch=256, max_wait=0.005, queue_size=1024, pool=None):
+        self.cg = cg
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.pool = pool
+        self.queue = Queue.Queue(queue_size)
+        self.batches = 0
+        self.resolved = 0
+        self.thread = threading.Thread(target=self.run, name='batcher')
+        self.thread.daemon = True
+
+
+    def start(self):
+        self.thread.start()
+
+
+    '''Resolve the requests still queued, then stop the thread.'''
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+    '''Resolve locations; blocks until done. Raises Queue.Full if the queue
+    stays full for timeout seconds (None waits indefinitely).'''
+    def submit(self, locations, timeout=None):
+        request = Request(locations)
+        self.queue.put(request, True, timeout)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.answers
+
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            request = self.queue.get()
+            if request is None:
+                break
+            batch = [request]
+            size = len(request.locations)
+            # Collect more requests until the batch is full or the first
+            # request has waited long enough
+            deadline = time.time() + self.max_wait
+            while size < self.max_batch:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self.queue.get(True, remaining)
+                except Queue.Empty:
+                    break
+                if request is None:
+                    stopping = True
+                    break
+                batch.append(request)
+                size += len(request.locations)
+            self.__resolve(batch)
+
+
+    def __resolve(self, batch):
+        locations = []
+        for request in batch:
+            locations.extend(request.locations)
+        try:
+            if self.pool is None:
+                answers = self.cg.guess_many(locations, workers=1)
+            else:
+                answers = self.cg.guess_many(locations, pool=self.pool)
+        except Exception, e:
+            for request in batch:
+                request.error = e
+                request.done.set()
+            return
+        self.batches += 1
+        self.resolved += len(locations)
+        start = 0
+        for request in batch:
+            request.answers = answers[start:start + len(request.locations)]
+            start += len(request.locations)
+            request.done.set()
+
+
+class ResolveHandler(SocketServer.StreamRequestHandler):
+    '''Serves one connection: one JSON object per line in, one out.'''
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            line = line.strip()
+            if not len(line):
+                continue
+            reply = self.__reply(line)
+            self.wfile.write(json.dumps(reply) + '\n')
+            self.wfile.flush()
+
+
+    def __reply(self, line):
+        try:
+            message = json.loads(line)
+        except ValueError:
+            return {'error':'invalid JSON'}
+        if not isinstance(message, dict):
+            return {'error':'expected a JSON object'}
+
+        reply = {}
+        if 'id' in message:
+            reply['id'] = message['id']
+        single = isinstance(message.get('location'), basestring)
+        if single:
+            locations = [message['location']]
+        elif isinstance(message.get('locations'), list) and \
+                all([isinstance(l, basestring) for l in message['locations']]):
+            locations = message['locations']
+        else:
+            reply['error'] = 'expected "location" (a string) or "locations" (a list of strings)'
+            return reply
+
+        try:
+            answers = self.server.batcher.submit(locations, self.server.queue_timeout)
+        except Queue.Full:
+            reply['error'] = 'busy'
+            return reply
+        except Exception, e:
+            reply['error'] = str(e)
+            return reply
+        if single:
+            reply['countries'] = answers[0]
+        else:
+            reply['countries'] = answers
+        return reply
+
+
+class UnixServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+class TCPServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class Client:
+    '''Minimal client of the service, e.g., for tests and load generators.
+    Pass the path of the unix socket, or the (host, port) of a TCP one.'''
+
+    def __init__(self, address):
+        if isinstance(address, basestring):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.connect(address)
+        self.f = self.sock.makefile('rwb')
+        self.next_id = 0
+
+
+    def __call(self, message):
+        self.next_id += 1
+        message['id'] = self.next_id
+        self.f.write(json.dumps(message) + '\n')
+        self.f.flush()
+        reply = json.loads(self.f.readline())
+        if 'error' in reply:
+            raise RuntimeError(reply['error'])
+        return reply['countries']
+
+
+    def guess(self, location):
+        return self.__call({'location':location})
+
+
+    def guess_many(self, locations):
+        return self.__call({'locations':list(locations)})
+
+
+    def close(self):
+        self.f.close()
+        self.sock.close()
+
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(description='Serve country guesses over a local socket.')
+    parser.add_argument('--socket',
+                        help='path of the unix socket to listen on')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='TCP host, with --port (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int,
+                        help='TCP port to listen on, instead of a unix socket')
+    parser.add_argument('--max-batch', type=int, default=256,
+                        help='most locations resolved in one batch (default: 256)')
+    parser.add_argument('--max-wait-ms', type=float, default=5.0,
+                        help='longest a request waits for its batch to fill (default: 5)')
+    parser.add_argument('--queue-size', type=int, default=1024,
+                        help='requests waiting to be batched before clients are held up (default: 1024)')
+    parser.add_argument('--queue-timeout', type=float, default=1.0,
+                        help='seconds a request may wait for room in the queue '
+                             'before it is refused as busy (default: 1)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='worker processes resolving the batches (default: 1)')
+    parser.add_argument('--cache-size', type=int, default=100000,
+                        help='memoised locations (default: 100000)')
+    parser.add_argument('--result-cache',
+                        help='SQLite file keeping the answers across runs (see resultCache)')
+    parser.add_argument('--scope',
+                        help='comma-separated countries, TLDs or regions to load; '
+                             'locations elsewhere resolve to "other" (see regionScope)')
+    parser.add_argument('--cities',
+                        help='GeoNames dump to read the cities from (default: data/cities1000.csv; '
+                             'prebuild its index with cityIndexBuilder)')
+    parser.add_argument('--mapped', action='store_true',
+                        help='use the memory-mapped city index (see mappedIndex)')
+    args = parser.parse_args(argv)
+    if (args.socket is None) == (args.port is None):
+        parser.error('give either --socket or --port')
+    return args
+
+
+def main(argv=None):
+    args = parseArgs(argv)
+
+    if args.mapped:
+        cg = CountryGuesser(cache_size=args.cache_size, mapped=MAPPED_PATH, result_cache=args.result_cache,
+                            scope=args.scope, cities=args.cities)
+    else:
+        cg = CountryGuesser(cache_size=args.cache_size, result_cache=args.result_cache, scope=args.scope,
+                            cities=args.cities)
+    # Fork the workers before any threads are started
+    pool = cg.make_pool(args.workers) if args.workers > 1 else None
+    batcher = Batcher(cg, args.max_batch, args.max_wait_ms / 1000.0, args.queue_size, pool)
+
+    if args.socket is not None:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = UnixServer(args.socket, ResolveHandler)
+        address = args.socket
+    else:
+        server = TCPServer((args.host, args.port), ResolveHandler)
+        address = '%s:%d' % server.server_address
+    server.batcher = batcher
+    server.queue_timeout = args.queue_timeout
+
+    # Shut down cleanly on SIGTERM too (service managers); installed
+    # after forking, so the workers keep the default
+    def terminate(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, terminate)
+    
+    batcher.start()
+    print >>sys.stderr, 'Listening on', address
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.stop()
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if args.socket is not None and os.path.exists(args.socket):
+            os.remove(args.socket)
+        print >>sys.stderr, batcher.resolved, 'locations resolved in', batcher.batches, 'batches'
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,305 @@
+# This Python file uses the following encoding: utf-8
+
+"""Copyright 2014 Bogdan Vasilescu
+Eindhoven University of Technology
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+# Answers of CountryGuesser kept on disk across runs, in an SQLite file:
+#
+#   cg = CountryGuesser(result_cache='data/results.sqlite')
+#
+# Each answer is stored under the fingerprint of the guesser that gave it
+# (data files, thresholds, overlay; see CountryGuesser.fingerprint), with
+# the rules behind it, so answers of other data or parameters are never
+# returned. Any number of processes can use the same file: each opens its
+# own connection (again after a fork), and SQLite serialises the writes.
+
+import os
+import json
+import atexit
+import sqlite3
+import weakref
+import threading
+
+this_dir, this_filename = os.path.split(__file__)
+DATA_PATH = os.path.join(this_dir, 'data')
+
+# Default location of the cache
+RESULT_CACHE_PATH = os.path.join(DATA_PATH, 'results.sqlite')
+
+# Bump whenever the rules or decisions change the answers they give; part
+# of the fingerprint of the guessers
+RESULT_CACHE_VERSION = 1
+
+# Locations per SELECT (SQLite allows 999 parameters)
+BATCH_SIZE = 500
+
+# Answers buffered by put before they are written
+FLUSH_EVERY = 1000
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS fingerprints (
+           id INTEGER PRIMARY KEY,
+           fingerprint TEXT UNIQUE NOT NULL)''',
+    '''CREATE TABLE IF NOT EXISTS results (
+           fingerprint INTEGER NOT NULL,
+           location TEXT NOT NULL,
+           countries TEXT NOT NULL,
+           rules TEXT NOT NULL,
+           decision TEXT NOT NULL,
+           PRIMARY KEY (fingerprint, location))''',
+]
+
+# The caches of this process, flushed at exit; not kept alive for it
+_caches = weakref.WeakSet()
+
+
+def _flushAll():
+    for cache in list(_caches):
+        cache.flush()
+
+atexit.register(_flushAll)
+
+
+'''The countries of an answer as the guessers give them: SQLite and JSON
+give unicode names, guess str ones.'''
+def _countries(countries):
+    return [c.encode('utf-8') if c is not None else None for c in countries]
+
+
+'''The rules of an answer as the guessers give them: (country, label)
+tuples of str.'''
+def _rules(rules):
+    return [(country.encode('utf-8'), label.encode('utf-8')) for (country, label) in rules]
+
+
+class ResultCache:
+    '''Normalised location -> countries, per fingerprint, in the SQLite file
+    at path. timeout is how long to wait for other processes writing.
+    Answers are written in batches: putMany writes at once, put buffers
+    up to FLUSH_EVERY answers (flushed by close, when the cache is dropped,
+    and at exit). The lookups also see the buffered answers.'''
+
+    def __init__(self, path=RESULT_CACHE_PATH, timeout=60.0):
+        self.path = path
+        self.timeout = timeout
+        # The connection may be used by several threads, one at a time
+        self.lock = threading.RLock()
+        self.pid = None
+        self.connection = None
+        # Connections of the parent after a fork; never used nor closed
+        self.inherited = []
+        self.fingerprintIds = {}
+        # (fingerprint, location) -> (countries, rules, decision)
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+        self.__connect()
+        _caches.add(self)
+
+
+    def __del__(self):
+        # Dropped without close
+        if self.pending:
+            self.flush()
+
+
+    def __connect(self):
+        if self.connection is not None:
+            self.inherited.append(self.connection)
+        connection = sqlite3.connect(self.path, self.timeout, check_same_thread=False)
+        try:
+            # Readers and one writer at a time, without blocking each other
+            connection.execute('PRAGMA journal_mode=WAL')
+        except sqlite3.DatabaseError:
+            # E.g., a file system without shared memory: default journal
+            pass
+        connection.execute('PRAGMA synchronous=NORMAL')
+        with connection:
+            for statement in SCHEMA:
+                connection.execute(statement)
+        self.connection = connection
+        self.pid = os.getpid()
+        self.fingerprintIds = {}
+        # Buffered in the parent; it writes them itself
+        self.pending = {}
+
+
+    '''The connection of this process (opened anew in a forked child).'''
+    def __connection(self):
+        if self.pid != os.getpid():
+            self.__connect()
+        return self.connection
+
+
+    def __fingerprintId(self, fingerprint, create=False):
+        i = self.fingerprintIds.get(fingerprint)
+        if i is None:
+            connection = self.__connection()
+            if create:
+                with connection:
+                    connection.execute('INSERT OR IGNORE INTO fingerprints (fingerprint) VALUES (?)',
+                                       (fingerprint,))
+            row = connection.execute('SELECT id FROM fingerprints WHERE fingerprint = ?',
+                                     (fingerprint,)).fetchone()
+            if row is None:
+                return None
+            i = self.fingerprintIds[fingerprint] = row[0]
+        return i
+
+
+    '''The answers of the locations found: location -> (countries, rules,
+    decision) for those still buffered by put in this process, and the
+    rows (location, then the given columns) of the others, selected in
+    batches. Counts the hits and misses.'''
+    def __select(self, fingerprint, locations, columns):
+        buffered = {}
+        rows = []
+        with self.lock:
+            locations = list(set(locations))
+            if self.pid == os.getpid() and len(self.pending):
+                for location in locations:
+                    record = self.pending.get((fingerprint, location))
+                    if record is not None:
+                        buffered[location] = record
+                locations = [location for location in locations if location not in buffered]
+            i = self.__fingerprintId(fingerprint)
+            if i is not None:
+                connection = self.__connection()
+                for start in range(0, len(locations), BATCH_SIZE):
+                    batch = locations[start:start + BATCH_SIZE]
+                    query = 'SELECT location, %s FROM results WHERE fingerprint = ? AND location IN (%s)' \
+                            % (columns, ','.join(['?'] * len(batch)))
+                    rows.extend(connection.execute(query, [i] + batch))
+            self.hits += len(buffered) + len(rows)
+            self.misses += len(locations) - len(rows)
+        return buffered, rows
+
+
+    '''location -> countries for the locations found (in batches).'''
+    def getMany(self, fingerprint, locations):
+        buffered, rows = self.__select(fingerprint, locations, 'countries')
+        found = dict([(location, _countries(json.loads(countries))) for (location, countries) in rows])
+        for (location, (countries, _, _)) in buffered.iteritems():
+            found[location] = list(countries)
+        return found
+
+
+    '''location -> (countries, rules, decision) for the locations found,
+    as putMany got them (rules as tuples).'''
+    def explainMany(self, fingerprint, locations):
+        buffered, rows = self.__select(fingerprint, locations, 'countries, rules, decision')
+        found = {}
+        for (location, countries, rules, decision) in rows:
+            found[location] = (_countries(json.loads(countries)), _rules(json.loads(rules)),
+                               decision.encode('utf-8'))
+        for (location, (countries, rules, decision)) in buffered.iteritems():
+            found[location] = (list(countries), [tuple(rule) for rule in rules], decision)
+        return found
+
+
+    '''The countries of location, or None if not cached.'''
+    def get(self, fingerprint, location):
+        return self.getMany(fingerprint, [location]).get(location)
+
+
+    '''Write answers: (location, countries, rules, decision) records, with
+    rules a list of [country, rule label] and decision a label.'''
+    def putMany(self, fingerprint, records):
+        if not len(records):
+            return
+        with self.lock:
+            i = self.__fingerprintId(fingerprint, True)
+            rows = [(i, location, json.dumps(countries), json.dumps(rules), decision)
+                    for (location, countries, rules, decision) in records]
+            connection = self.__connection()
+            with connection:
+                connection.executemany('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)', rows)
+
+
+    '''Buffer an answer (see putMany).'''
+    def put(self, fingerprint, location, countries, rules, decision):
+        with self.lock:
+            self.__connection()
+            self.pending[(fingerprint, location)] = (countries, rules, decision)
+            if len(self.pending) >= FLUSH_EVERY:
+                self.flush()
+
+
+    '''Write the buffered answers.'''
+    def flush(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                # The parent's buffer; it writes it itself
+                return
+            pending = self.pending
+            self.pending = {}
+            byFingerprint = {}
+            for ((fingerprint, location), (countries, rules, decision)) in pending.iteritems():
+                byFingerprint.setdefault(fingerprint, []).append((location, countries, rules, decision))
+            for (fingerprint, records) in byFingerprint.iteritems():
+                self.putMany(fingerprint, records)
+
+
+    '''The rules and decision recorded with the answer for location, as
+    (rules, decision), or None.'''
+    def explain(self, fingerprint, location):
+        with self.lock:
+            if self.pid == os.getpid() and (fingerprint, location) in self.pending:
+                _, rules, decision = self.pending[(fingerprint, location)]
+                return [tuple(rule) for rule in rules], decision
+            i = self.__fingerprintId(fingerprint)
+            if i is None:
+                return None
+            row = self.__connection().execute(
+                'SELECT rules, decision FROM results WHERE fingerprint = ? AND location = ?',
+                (i, location)).fetchone()
+        if row is None:
+            return None
+        return _rules(json.loads(row[0])), row[1].encode('utf-8')
+
+
+    '''Delete the answers of all other fingerprints (e.g., after a data
+    update), and reclaim the space.'''
+    def prune(self, fingerprint):
+        with self.lock:
+            self.flush()
+            i = self.__fingerprintId(fingerprint)
+            connection = self.__connection()
+            with connection:
+                # None (never stored) keeps nothing
+                connection.execute('DELETE FROM results WHERE fingerprint IS NOT ?', (i,))
+                connection.execute('DELETE FROM fingerprints WHERE id IS NOT ?', (i,))
+            connection.execute('VACUUM')
+            self.fingerprintIds = {}
+
+
+    def close(self):
+        with self.lock:
+            self.flush()
+            if self.pid == os.getpid():
+                self.connection.close()
+            self.connection = None
+            self.pid = None
+
+
+if __name__=="__main__":
+    import sys
+    # Answers per fingerprint in a cache file
+    cache = ResultCache(sys.argv[1] if len(sys.argv) > 1 else RESULT_CACHE_PATH)
+    for (fingerprint, count) in cache.connection.execute(
+            'SELECT f.fingerprint, COUNT(*) FROM results r JOIN fingerprints f ON r.fingerprint = f.id '
+            'GROUP BY f.fingerprint'):
+        print fingerprint, count
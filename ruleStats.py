@@ -0,0 +1,69 @@
+# This Python file uses the following encoding: utf-8
+
+"""Copyright 2014 Bogdan Vasilescu
+Eindhoven University of Technology
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+
+class RuleStats:
+    '''Instrumentation for CountryGuesser: cumulative time, number of calls
+    and number of hits (calls producing candidates) per rule, and how
+    often each decision branch of guess produced the answer.
+
+        stats = RuleStats()
+        cg = CountryGuesser(stats=stats)
+        ...
+        print stats.report(cg.rule_labels, cg.decision_labels)'''
+
+    def __init__(self):
+        self.reset()
+
+
+    def reset(self):
+        self.seconds = {}
+        self.calls = {}
+        self.hits = {}
+        self.decisions = {}
+
+
+    def record(self, rule, seconds, hit):
+        self.seconds[rule] = self.seconds.get(rule, 0.0) + seconds
+        self.calls[rule] = self.calls.get(rule, 0) + 1
+        if hit:
+            self.hits[rule] = self.hits.get(rule, 0) + 1
+
+
+    def decided(self, decision):
+        self.decisions[decision] = self.decisions.get(decision, 0) + 1
+
+
+    '''Per rule: (seconds, calls, hits), most expensive first.'''
+    def rules(self):
+        return sorted([(rule, self.seconds[rule], self.calls[rule], self.hits.get(rule, 0))
+                       for rule in self.calls], key=lambda e:-e[1])
+
+
+    def report(self, rule_labels=None, decision_labels=None):
+        rule_labels = rule_labels or {}
+        decision_labels = decision_labels or {}
+        lines = ['%-14s %10s %10s %10s %10s' % ('rule', 'seconds', 'calls', 'hits', 'us/call')]
+        for (rule, seconds, calls, hits) in self.rules():
+            lines.append('%-14s %10.3f %10d %10d %10.1f' % (rule_labels.get(rule, rule),
+                         seconds, calls, hits, 1e6 * seconds / calls))
+        lines.append('')
+        lines.append('%-14s %10s' % ('decision', 'count'))
+        for decision, count in sorted(self.decisions.items(), key=lambda e:-e[1]):
+            lines.append('%-14s %10d' % (decision_labels.get(decision, decision), count))
+        return '\n'.join(lines)
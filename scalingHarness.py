@@ -0,0 +1,259 @@
+# This Python file uses the following encoding: utf-8
+
+"""Copyright 2014 Bogdan Vasilescu
+Eindhoven University of Technology
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>."""
+
+# Scaling of CountryGuesser over cores and corpus sizes, on synthetic
+# corpora (see loadGenerator):
+#
+#   python scalingHarness.py --sizes 10000,100000,1000000 --cores 1,2,4,8 --json report.json
+#
+# Each (size, cores) run is a fresh process: it loads the guesser (from
+# the snapshot, or the mapped index), forks a pool of workers (cores > 1)
+# and resolves the corpus in chunks, as resolveLocations does. Measured:
+#  - throughput: rows per second of wall time, after loading
+#  - latency: the time of each guess call, in the worker making it
+#  - peak RSS: of the process, and of the largest worker
+# The report (JSON) describes the host, the data, the settings and the
+# corpora, then every run, with its speedup and efficiency over 1 core.
+# Reports of the same settings can be compared across releases.
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import platform
+import argparse
+import resource
+import subprocess
+import multiprocessing
+from array import array
+from timeit import default_timer as timer
+
+from benchmark import quiet, summary, readSample
+from countryGuesser import CountryGuesser
+from mappedIndex import MAPPED_PATH
+from loadGenerator import LoadGenerator, describe, DISTINCT, ZIPF
+import indexSnapshot
+
+# Bump whenever the layout of the report changes
+REPORT_VERSION = 1
+
+# Locations per task sent to a worker
+CHUNK = 500
+
+# The guesser of the run; pool workers inherit it through fork
+_guesser = None
+
+
+'''Resolve the locations, timing every call. Returns the latencies as
+a string of doubles, which is cheap to send back.'''
+def _timeChunk(locations):
+    latencies = array('d')
+    guess = _guesser.guess
+    for location in locations:
+        start = timer()
+        guess(location)
+        latencies.append(timer() - start)
+    return latencies.tostring()
+
+
+'''Peak RSS, in MB, of this process (RUSAGE_SELF) or of its largest
+waited-for child (RUSAGE_CHILDREN).'''
+def peakRSS(who=resource.RUSAGE_SELF):
+    kilobytes = resource.getrusage(who).ru_maxrss
+    if sys.platform == 'darwin':
+        # Bytes there
+        kilobytes /= 1024
+    return round(kilobytes / 1024.0, 1)
+
+
+def readCorpus(path):
+    f = open(path, 'rb')
+    locations = [unicode(line.rstrip('\n'), 'utf-8') for line in f]
+    f.close()
+    return locations
+
+
+def writeCorpus(path, locations):
+    f = open(path, 'wb')
+    for location in locations:
+        f.write(location.encode('utf-8') + '\n')
+    f.close()
+
+
+'''One run, in this process: resolve the corpus at path with cores
+processes. Returns the measurements.'''
+def run(path, cores, cache_size=100000, mapped=False, chunk=CHUNK):
+    global _guesser
+    locations = readCorpus(path)
+    with quiet():
+        start = timer()
+        if mapped:
+            _guesser = CountryGuesser(cache_size=cache_size, mapped=MAPPED_PATH)
+        else:
+            _guesser = CountryGuesser(cache_size=cache_size)
+        loaded = timer() - start
+    chunks = [locations[i:i + chunk] for i in xrange(0, len(locations), chunk)]
+
+    latencies = array('d')
+    start = timer()
+    if cores <= 1:
+        for c in chunks:
+            latencies.fromstring(_timeChunk(c))
+    else:
+        pool = multiprocessing.Pool(cores)
+        try:
+            for result in pool.imap(_timeChunk, chunks):
+                latencies.fromstring(result)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    seconds = timer() - start
+
+    results = summary(latencies, seconds)
+    results.update({
+        'rows':len(locations),
+        'cores':cores,
+        'init_seconds':loaded,
+        'rss_mb':peakRSS(),
+        'rss_worker_mb':peakRSS(resource.RUSAGE_CHILDREN) if cores > 1 else None,
+    })
+    return results
+
+
+'''Run the corpus at path with cores processes in a fresh Python process
+(so its memory is measured alone), and return its measurements.'''
+def runIsolated(path, cores, args):
+    command = [sys.executable, os.path.abspath(__file__), '--run', path, '--cores', str(cores),
+               '--cache-size', str(args.cache_size), '--chunk', str(args.chunk)]
+    if args.mapped:
+        command.append('--mapped')
+    output = subprocess.check_output(command)
+    # The measurements are the last line; anything before is reporting
+    return json.loads(output.strip().split('\n')[-1])
+
+
+'''A measurement for the table; '-' if there is none (e.g., no calls).'''
+def _format(value, format='%.0f'):
+    return '-' if value is None else format % value
+
+
+'''Generate the corpora and run every size on every number of cores.
+Returns the report.'''
+def measure(args):
+    report = {
+        'version':REPORT_VERSION,
+        'created':time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host':{'platform':platform.platform(), 'python':platform.python_version(),
+                'cpus':multiprocessing.cpu_count()},
+        'data':indexSnapshot.checksum(),
+        'settings':{'seed':args.seed, 'distinct':args.distinct, 'zipf':args.zipf,
+                    'cache_size':args.cache_size, 'mapped':args.mapped, 'chunk':args.chunk},
+        'sample':describe(readSample()),
+        'corpora':[],
+        'runs':[],
+    }
+    with quiet():
+        generator = LoadGenerator(args.seed)
+    tmp_dir = tempfile.mkdtemp(prefix='scaling')
+    try:
+        for size in args.sizes:
+            start = timer()
+            locations = generator.corpus(size, args.distinct, args.zipf)
+            corpus = describe(locations)
+            corpus['generate_seconds'] = timer() - start
+            report['corpora'].append(corpus)
+            path = os.path.join(tmp_dir, '%d.txt' % size)
+            writeCorpus(path, locations)
+            del locations
+
+            base = None
+            for cores in args.cores:
+                r = runIsolated(path, cores, args)
+                if cores == 1:
+                    base = r['per_second']
+                r['speedup'] = r['per_second'] / base if base else None
+                r['efficiency'] = r['speedup'] / cores if base else None
+                report['runs'].append(r)
+                print '%9d rows %3d cores: %8s rows/s  p50 %6sus  p99 %7sus  max %8sus  ' \
+                      'RSS %7.1f MB (worker %s MB)  speedup %s' % \
+                    (size, cores, _format(r['per_second']), _format(r['p50_us']), _format(r['p99_us']),
+                     _format(r['max_us']), r['rss_mb'], _format(r['rss_worker_mb'], '%.1f'),
+                     _format(r['speedup'], '%.2f'))
+    finally:
+        shutil.rmtree(tmp_dir, True)
+    return report
+
+
+'''1, 2, 4, ... up to the number of cores of the host (included).'''
+def defaultCores():
+    cpus = multiprocessing.cpu_count()
+    cores = [1]
+    while cores[-1] * 2 < cpus:
+        cores.append(cores[-1] * 2)
+    if cpus > 1:
+        cores.append(cpus)
+    return ','.join([str(c) for c in cores])
+
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(description='Measure the scaling of CountryGuesser over cores.')
+    parser.add_argument('--sizes', default='10000,100000',
+                        help='comma-separated corpus sizes (default: 10000,100000)')
+    parser.add_argument('--cores', default=defaultCores(),
+                        help='comma-separated process counts (default: 1, 2, 4, ... up to %d)'
+                             % multiprocessing.cpu_count())
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the corpora (default: 0)')
+    parser.add_argument('--distinct', type=float, default=DISTINCT,
+                        help='share of distinct locations (default: %s)' % DISTINCT)
+    parser.add_argument('--zipf', type=float, default=ZIPF,
+                        help='Zipf exponent of the frequencies (default: %s)' % ZIPF)
+    parser.add_argument('--cache-size', type=int, default=100000,
+                        help='memoised locations per process (default: 100000)')
+    parser.add_argument('--chunk', type=int, default=CHUNK,
+                        help='locations per worker task (default: %d)' % CHUNK)
+    parser.add_argument('--mapped', action='store_true',
+                        help='use the memory-mapped city index (see mappedIndex)')
+    parser.add_argument('--json',
+                        help='write the report to this file')
+    # A single run, in a fresh process (see runIsolated)
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    args.sizes = [int(s) for s in args.sizes.split(',')]
+    args.cores = [int(c) for c in args.cores.split(',')]
+    if args.run is None and 1 not in args.cores:
+        # Speedups are relative to 1 core
+        args.cores.insert(0, 1)
+    return args
+
+
+if __name__=="__main__":
+    args = parseArgs(sys.argv[1:])
+    if args.run is not None:
+        print json.dumps(run(args.run, args.cores[0], args.cache_size, args.mapped, args.chunk))
+    else:
+        report = measure(args)
+        if args.json:
+            f = open(args.json, 'wb')
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.close()
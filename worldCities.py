@@ -17,75 +17,179 @@ You should have received a copy of the GNU Lesser General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>."""
 
 import os
-from unidecode import unidecode
-from unicodeManager import UnicodeReader
-from worldCountries import WorldCountries
-from blackList import BlackList
+import itertools
+from cityIndexBuilder import CityIndexBuilder, CITIES_PATH, CHUNK_LINES
 
 this_dir, this_filename = os.path.split(__file__)
 DATA_PATH = os.path.join(this_dir, 'data')
 
+
+class CityView:
+    '''Read-only dict-like view of WorldCities: city name -> set of
+    (country, population), restricted to cities with a population of at
+    least min_population and names of at least min_length characters.'''
+    
+    def __init__(self, cities, min_population=0, min_length=0):
+        self.cities = cities
+        self.min_population = min_population
+        self.min_length = min_length
+        self.size = None
+    
+    
+    def __getitem__(self, city):
+        postings = self.cities.postings(city, self.min_population, self.min_length)
+        if not len(postings):
+            raise KeyError(city)
+        return set(postings)
+    
+    
+    def get(self, city, default=None):
+        postings = self.cities.postings(city, self.min_population, self.min_length)
+        return set(postings) if len(postings) else default
+    
+    
+    def __contains__(self, city):
+        return self.cities.hasCity(city, self.min_population, self.min_length)
+    
+    
+    def has_key(self, city):
+        return city in self
+    
+    
+    def iterkeys(self):
+        for city in self.cities.names():
+            if self.cities.hasCity(city, self.min_population, self.min_length):
+                yield city
+    
+    __iter__ = iterkeys
+    
+    
+    def keys(self):
+        return list(self.iterkeys())
+    
+    
+    def __len__(self):
+        if self.size is None:
+            self.size = len(self.keys())
+        return self.size
+
+
+
 class WorldCities():
+    '''All (non-blacklisted) city names, with their countries and populations.
+    The minimum population and name length are parameters of each lookup,
+    so one loaded index serves any thresholds. MIN_CITY_LENGTH and
+    MIN_POPULATION are the defaults of the two dict-style views.
+    countries (WorldCountries) and blackList (BlackList) default to the
+    shared instances of dataRegistry.
+
+    The cities are read from the GeoNames dump at path (see
+    CityIndexBuilder for delimiter, and for workers to parse it in
+    parallel). unknownCodes lists the country codes it has that are
+    missing from countries.csv. With a scope (RegionScope), only the
+    cities it keeps are loaded.'''
     
-    def __init__(self, MIN_CITY_LENGTH=5, MIN_POPULATION=50000):
+    def __init__(self, MIN_CITY_LENGTH=5, MIN_POPULATION=50000, countries=None, blackList=None,
+                 path=CITIES_PATH, delimiter=';', workers=1, chunk_lines=CHUNK_LINES, scope=None):
         self.MIN_CITY_LENGTH = MIN_CITY_LENGTH
         self.MIN_POPULATION = MIN_POPULATION
         
+        # Imported here: dataRegistry imports this module
+        import dataRegistry
+        if countries is None:
+            countries = dataRegistry.get('WorldCountries')
+        if blackList is None:
+            blackList = dataRegistry.get('BlackList')
+        
         # Most likely, these do not refer to actual city names
-        self.blackList = BlackList().dict
+        self.blackList = blackList.dict
 #        print self.blackList.keys()
 
-        self.city2countryPopulation = {}
-        self.largeCity2countryPopulation = {}
-        
-        countries = WorldCountries()
-        
         # Load data
         # GeoNames list of cities: http://download.geonames.org/export/dump/
-        f = open(os.path.join(DATA_PATH, 'cities1000.csv'), 'rb')
-        reader = UnicodeReader(f)
+        # Rows with country codes missing from countries.csv are left out
+        # and reported
+        builder = CityIndexBuilder(countries, self.blackList, workers, chunk_lines, scope)
+        builder.build(path, delimiter)
+        for line in builder.report():
+            print line
+        self.rows = builder.rows
+        self.unknownCodes = builder.unknownCodes
         
-        for row in reader:
-            city = unidecode(row[2]).lower().strip()
-            # Alternative names/spellings for the same city
-            alternatives = [a for a in [unidecode(a).lower().strip() for a in row[3].split(',')] 
-                            if len(a) >= self.MIN_CITY_LENGTH 
-                            and not self.blackList.has_key(a)]
-            population = int(row[14])
-            # Country 2-letter code
-            code = row[8].lower()
-            
-            if len(city) >= self.MIN_CITY_LENGTH and not self.blackList.has_key(city):
-                try:
-                    country = countries.tld2name[code]
-                except:
-                    # Not all possible 2-letter country codes are known in countries.csv
-                    # If necessary, add manually and rerun
-                    print 'UNKNOWN CODE:', city, population, code
-                    exit()
-                    
-                self.city2countryPopulation.setdefault(city, set([(country, population)]))
-                self.city2countryPopulation[city].add((country, population))
-                        
-                # Record same country for all alternative names of this city
-                for a in alternatives:
-                    self.city2countryPopulation.setdefault(a, set([(country, population)]))
-                    self.city2countryPopulation[a].add((country, population))
+        # Country names are stored once; cities refer to them by id
+        self.countries = builder.countries
+        self.country2id = dict([(country, i) for (i, country) in enumerate(self.countries)])
         
-                # Also keep a shorter list with large cities only
-                if population >= self.MIN_POPULATION:                
-                    # Record country for this city
-                    # Note: Two cities with the same name in different countries
-                    # or even two cities with the same name in the same country
-                    # are recorded separately
-                    self.largeCity2countryPopulation.setdefault(city, set([(country, population)]))
-                    self.largeCity2countryPopulation[city].add((country, population))
-                        
-                    # Record same country for all alternative names of this city
-                    for a in alternatives:
-                        self.largeCity2countryPopulation.setdefault(a, set([(country, population)]))
-                        self.largeCity2countryPopulation[a].add((country, population))
-        f.close()
+        # Every city name (or alternative name) has an id, pointing to its
+        # postings: (country id, population, name length) for each city
+        # with that name, largest population first. The name length is the
+        # shorter of the name and the city's main name: alternative names
+        # only count if the main name is long enough. The postings of all
+        # names are stored back to back in arrays; those of name id i are
+        # at positions offsets[i] until offsets[i+1]. Ids follow the sorted
+        # order of the names, like the pattern ids of AhoCorasick, so a
+        # name found by the matcher needs no further lookup.
+        self.name2id = dict(itertools.izip(builder.names, itertools.count()))
+        self.offsets = builder.offsets
+        self.postingCountries = builder.postingCountries
+        self.postingPopulations = builder.postingPopulations
+        self.postingNameLengths = builder.postingNameLengths
+        
+        # Dictionary-style access with the default thresholds; large cities
+        # are those with population >= MIN_POPULATION
+        self.city2countryPopulation = CityView(self, 0, self.MIN_CITY_LENGTH)
+        self.largeCity2countryPopulation = CityView(self, self.MIN_POPULATION, self.MIN_CITY_LENGTH)
+    
+    
+    '''The id of a city name (its postings), or None if unknown.'''
+    def nameId(self, city):
+        return self.name2id.get(city)
+    
+    
+    '''All city names, in id order.'''
+    def names(self):
+        return iter(sorted(self.name2id.iterkeys()))
+    
+    
+    '''The (country, population) pairs recorded for a city name, largest
+    population first, restricted to population >= min_population and
+    names of at least min_length characters.'''
+    def postings(self, city, min_population=0, min_length=0):
+        i = self.nameId(city)
+        if i is None:
+            return []
+        return self.postingsById(i, min_population, min_length)
+    
+    
+    def postingsById(self, i, min_population=0, min_length=0):
+        postings = []
+        for k in xrange(self.offsets[i], self.offsets[i + 1]):
+            population = self.postingPopulations[k]
+            if population < min_population:
+                break
+            if self.postingNameLengths[k] >= min_length:
+                postings.append((self.countries[self.postingCountries[k]], population))
+        return postings
+    
+    
+    def hasCity(self, city, min_population=0, min_length=0):
+        i = self.nameId(city)
+        return i is not None and self.hasCityId(i, min_population, min_length)
+    
+    
+    def hasCityId(self, i, min_population=0, min_length=0):
+        for k in xrange(self.offsets[i], self.offsets[i + 1]):
+            if self.postingPopulations[k] < min_population:
+                return False
+            if self.postingNameLengths[k] >= min_length:
+                return True
+        return False
+    
+    
+    '''The country of the most populous city with this name.'''
+    def mostPopulousCountry(self, city, min_population=0, min_length=0):
+        postings = self.postings(city, min_population, min_length)
+        return postings[0][0] if len(postings) else None
 
 
 if __name__=="__main__":
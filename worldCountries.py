@@ -17,7 +17,7 @@ You should have received a copy of the GNU Lesser General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>."""
 
 import os
-from unidecode import unidecode
+from normalization import normalize, normalizeAll
 from unicodeManager import UnicodeReader
 
 this_dir, this_filename = os.path.split(__file__)
@@ -38,12 +38,12 @@ class WorldCountries():
         for row in reader:
 #            cid = int(row[0])
             # The country name
-            name = unidecode(row[1]).lower().strip()
+            name = normalize(row[1])
             self.namesSet.add(name)
             self.alternative2name[name] = name
             
             # Different alternative names, separated by comma
-            alternatives = [unidecode(a).lower().strip() for a in row[2].split(',') if len(row[2].strip())]
+            alternatives = normalizeAll(row[2]) if len(row[2].strip()) else []
             for a in alternatives:
                 self.alternative2name[a] = name
                 self.namesSet.add(a)